@@ -0,0 +1,455 @@
+# Times the public functions in modules/ against synthetic data sets.
+#
+#   python benchmark.py                          # 1k, 10k and 100k rows
+#   python benchmark.py --sizes 1000,1000000 --output bench.json
+#   python benchmark.py --stress 1,2,4 --sizes 1000
+#
+# Each size gets its own temporary data directory, so the real data is never
+# touched. The report is JSON: one entry per (size, operation) with the first
+# call's time (includes loading the table) and statistics over the repeats,
+# plus the time a fresh interpreter takes to import each entry point.
+#
+# --stress instead runs that many processes at once against one data set, each
+# posting payments and adding customers, then checks that no payment or
+# customer was lost and no customer ID was handed out twice; the exit status is
+# 1 if any was. Payments are serialised on the installments lock (see
+# installment.make_payment), so throughput is not expected to grow with the
+# number of processes.
+#
+# --serve starts server.py on each data set and drives it with that many
+# concurrent HTTP clients, reporting throughput, latency percentiles and
+# whether every payment the server accepted reached the files (exit status 1
+# if not).
+#
+#   python benchmark.py --serve 1,8,32 --sizes 10000
+
+import argparse
+import contextlib
+import csv
+import datetime
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from modules import config
+
+ENTRY_POINTS = ('main', 'cli', 'server')
+
+CITIES = ['Lahore', 'Karachi', 'Islamabad', 'Multan', 'Peshawar', 'Quetta', 'Faisalabad']
+PRODUCT_NAMES = ['Mobile Phone', 'Laptop', 'Television', 'Refrigerator', 'Motorcycle', 'Air Conditioner']
+
+def generate_data(data_dir, size, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    product_count = max(1, size // 10)
+
+    with open(os.path.join(data_dir, 'customers.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['customer_id', 'name', 'phone', 'address'])
+        for customer_id in range(1, size + 1):
+            writer.writerow([customer_id, f"Customer {customer_id}",
+                             f"03{rng.randrange(10**9):09d}", rng.choice(CITIES)])
+
+    prices = {}
+    with open(os.path.join(data_dir, 'products.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['product_id', 'product_name', 'price'])
+        for product_id in range(1, product_count + 1):
+            prices[product_id] = rng.randrange(10, 500) * 1000
+            writer.writerow([product_id, rng.choice(PRODUCT_NAMES), prices[product_id]])
+
+    with open(os.path.join(data_dir, 'installments.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['installment_id', 'customer_id', 'product_id', 'total_price',
+                         'paid_amount', 'remaining_amount', 'months', 'monthly_amount', 'start_date',
+                         'last_payment_id'])
+        today = datetime.date.today()
+        for installment_id in range(1, size + 1):
+            product_id = rng.randrange(1, product_count + 1)
+            total = float(prices[product_id])
+            paid = float(rng.randrange(0, int(total) + 1, 1000))
+            # Twelve-month plans started up to a year ago, so some are overdue.
+            start = today - datetime.timedelta(days=rng.randrange(0, 365))
+            writer.writerow([installment_id, rng.randrange(1, size + 1), product_id,
+                             total, paid, total - paid, 12, float(-(-int(total - paid) // 12)),
+                             start.isoformat(), ''])
+
+    return {'customers': size, 'products': product_count, 'installments': size}
+
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def operations(size, rng):
+    import modules.customer as customer
+    import modules.product as product
+    import modules.installment as installment
+    import modules.analytics as analytics
+    import modules.schedule as schedule
+    import modules.integrity as integrity
+    import modules.export as export
+    from modules.table import Table
+
+    product_count = max(1, size // 10)
+
+    def load_table(table, snapshots):
+        # A full load into a new Table, as a fresh process would do, either
+        # parsing the CSV or from its snapshot (the first call writes it).
+        def load():
+            previous = config.SNAPSHOTS
+            config.SNAPSHOTS = snapshots
+            try:
+                Table(table.filename, table.fieldnames, table.key, table.record).rows()
+            finally:
+                config.SNAPSHOTS = previous
+        return load
+
+    def some_customer():
+        return rng.randrange(1, size + 1)
+
+    def some_product():
+        return rng.randrange(1, product_count + 1)
+
+    def some_installment():
+        return rng.randrange(1, size + 1)
+
+    return [
+        ('table.load_parse', load_table(installment.installments_table, False)),
+        ('table.load_snapshot', load_table(installment.installments_table, True)),
+        ('customer.add_customer', lambda: customer.add_customer("Bench Customer", "03001234567", "Lahore")),
+        ('customer.search_customer', lambda: customer.search_customer(some_customer())),
+        ('customer.update_customer', lambda: customer.update_customer(some_customer(), address="Karachi")),
+        ('customer.find_customers', lambda: customer.find_customers(name=f"customer {some_customer()}")),
+        ('customer.find_customers_phone', lambda: customer.find_customers(phone=f"03{rng.randrange(10**5):05d}")),
+        ('customer.view_all_customers', lambda: customer.view_all_customers()),
+        ('product.add_product', lambda: product.add_product("Bench Product", "1000")),
+        ('product.search_product', lambda: product.search_product(some_product())),
+        ('product.update_product', lambda: product.update_product(some_product(), price="2000")),
+        ('product.view_all_products', lambda: product.view_all_products()),
+        ('installment.create_installment', lambda: installment.create_installment(some_customer(), some_product(), "1")),
+        ('installment.search_installment', lambda: installment.search_installment(some_installment())),
+        ('installment.make_payment', lambda: installment.make_payment(some_installment(), "1")),
+        ('installment.view_all_installments', lambda: installment.view_all_installments()),
+        ('installment.get_customer_installments', lambda: installment.get_customer_installments(some_customer())),
+        ('installment.get_customer_total_balance', lambda: installment.get_customer_total_balance(some_customer())),
+        ('installment.post_payments', lambda: installment.post_payments(
+            [(some_installment(), "1") for _ in range(100)])),
+        ('schedule.overdue_installments', schedule.overdue_installments),
+        ('schedule.due_installments', schedule.due_installments),
+        ('analytics.portfolio_summary', analytics.portfolio_summary),
+        ('analytics.collection_buckets', analytics.collection_buckets),
+        ('analytics.product_exposure', analytics.product_exposure),
+        ('analytics.customer_exposure', analytics.customer_exposure),
+        ('integrity.check_integrity', integrity.check_integrity),
+        ('export.statements_csv', lambda: export.export_report('statements', config.data_path('export.csv'), 'csv')),
+        ('export.balances_csv', lambda: export.export_report('balances', config.data_path('export.csv'), 'csv')),
+        ('export.products_json', lambda: export.export_report('products', config.data_path('export.json'), 'json')),
+        ('customer.delete_customer', lambda: customer.delete_customer(some_customer())),
+        ('product.delete_product', lambda: product.delete_product(some_product())),
+    ]
+
+def measure_imports(repeat):
+    # Milliseconds for a fresh interpreter, started outside the repository, to
+    # import each entry point: the fixed cost of every short-lived run.
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ims-import-') as workdir:
+        for module in ENTRY_POINTS:
+            code = f"import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+            timings = [float(subprocess.check_output([sys.executable, '-c', code], cwd=workdir, env=env))
+                       for _ in range(repeat)]
+            results.append({
+                'module': module,
+                'min_ms': round(min(timings), 3),
+                'median_ms': round(statistics.median(timings), 3),
+                'repeat': repeat,
+            })
+    return results
+
+def run_size(size, repeat, seed, only=None):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ims-bench-') as workdir:
+        started = time.perf_counter()
+        rows = generate_data(os.path.join(workdir, 'data'), size, seed)
+        generate_ms = (time.perf_counter() - started) * 1000
+
+        previous_dir = config.DATA_DIR
+        config.set_data_dir(os.path.join(workdir, 'data'))
+        try:
+            rng = random.Random(seed)
+            for name, func in operations(size, rng):
+                if only and not any(part in name for part in only):
+                    continue
+                # view_all_* print every row; keep the report readable.
+                with contextlib.redirect_stdout(io.StringIO()):
+                    first = time_call(func, 1)[0]
+                    timings = time_call(func, repeat)
+                results.append({
+                    'size': size,
+                    'operation': name,
+                    'first_ms': round(first, 3),
+                    'min_ms': round(min(timings), 3),
+                    'median_ms': round(statistics.median(timings), 3),
+                    'mean_ms': round(statistics.mean(timings), 3),
+                    'repeat': repeat,
+                })
+        finally:
+            config.set_data_dir(previous_dir)
+
+    return {'size': size, 'rows': rows, 'generate_ms': round(generate_ms, 3)}, results
+
+def _stress_worker(job):
+    data_dir, payments, installment_count, seed = job
+    config.set_data_dir(data_dir)
+    import modules.customer as customer
+    import modules.installment as installment
+
+    rng = random.Random(seed)
+    posted = 0
+    added = 0
+    for n in range(payments):
+        success, _ = installment.make_payment(rng.randrange(1, installment_count + 1), "1")
+        posted += success
+        if n % 10 == 0:
+            success, _ = customer.add_customer("Stress Customer", "03001234567", "Lahore")
+            added += success
+    return posted, added
+
+def _paid_total():
+    # What installments.csv holds plus the ledger payments it does not yet
+    # include.
+    from modules.file_handler import read_csv
+    installments = read_csv(config.data_path('installments.csv'))
+    included = {row['installment_id']: int(row.get('last_payment_id') or 0) for row in installments}
+    return (sum(float(row['paid_amount']) for row in installments) +
+            sum(float(row['amount']) for row in read_csv(config.data_path('payments.csv'))
+                if int(row['payment_id']) > included.get(row['installment_id'], 0)))
+
+def _customer_ids():
+    from modules.file_handler import read_csv
+    return [row['customer_id'] for row in read_csv(config.data_path('customers.csv'))]
+
+def run_stress(size, process_counts, payments, seed):
+    # Totals are read with file_handler.read_csv rather than through the
+    # module caches, so the check does not depend on what it is checking.
+    from modules import sqlite_backend
+    results = []
+    context = multiprocessing.get_context('spawn')
+    previous_dir = config.DATA_DIR
+    for processes in process_counts:
+        with tempfile.TemporaryDirectory(prefix='ims-stress-') as workdir:
+            data_dir = os.path.join(workdir, 'data')
+            rows = generate_data(data_dir, size, seed)
+            config.set_data_dir(data_dir)
+            try:
+                if config.use_sqlite():
+                    sqlite_backend.import_csv_files([config.data_path(name) for name in
+                                                     ('customers.csv', 'products.csv', 'installments.csv')])
+                paid_before = _paid_total()
+
+                jobs = [(data_dir, payments, rows['installments'], seed + n) for n in range(processes)]
+                started = time.perf_counter()
+                with context.Pool(processes) as pool:
+                    outcomes = pool.map(_stress_worker, jobs)
+                elapsed = time.perf_counter() - started
+
+                posted = sum(outcome[0] for outcome in outcomes)
+                added = sum(outcome[1] for outcome in outcomes)
+                paid_after = _paid_total()
+                customer_ids = _customer_ids()
+            finally:
+                config.set_data_dir(previous_dir)
+
+            results.append({
+                'size': size,
+                'processes': processes,
+                'payments_per_process': payments,
+                'elapsed_s': round(elapsed, 3),
+                'payments_per_s': round(processes * payments / elapsed, 1),
+                'payments_posted': posted,
+                'lost_payments': posted - round(paid_after - paid_before),
+                'customers_added': added,
+                'lost_customers': rows['customers'] + added - len(customer_ids),
+                'duplicate_customer_ids': len(customer_ids) - len(set(customer_ids)),
+            })
+    return results
+
+def _percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))] if ordered else 0.0
+
+def _serve_client(port, requests, rows, seed):
+    # One keep-alive connection issuing a mix of lookups, payments and
+    # reports. Returns (latencies in ms, errors, payments accepted).
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    errors = 0
+    paid = 0
+    try:
+        for _ in range(requests):
+            roll = rng.random()
+            body = None
+            if roll < 0.35:
+                method, path = 'GET', f"/customers/{rng.randint(1, rows['customers'])}"
+            elif roll < 0.6:
+                method, path = 'GET', f"/installments/{rng.randint(1, rows['installments'])}"
+            elif roll < 0.7:
+                method, path = 'GET', f"/customers/{rng.randint(1, rows['customers'])}/balance"
+            elif roll < 0.75:
+                method, path = 'GET', "/customers?name=ali"
+            elif roll < 0.8:
+                method, path = 'GET', "/reports/portfolio"
+            else:
+                method, path = 'POST', f"/installments/{rng.randint(1, rows['installments'])}/payments"
+                body = json.dumps({'amount': "1"}).encode('utf-8')
+            started = time.perf_counter()
+            connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            latencies.append((time.perf_counter() - started) * 1000)
+            if method == 'POST' and response.status == 201:
+                paid += 1
+            elif response.status >= 500:
+                errors += 1
+    finally:
+        connection.close()
+    return latencies, errors, paid
+
+def run_serve(size, client_counts, requests, seed):
+    results = []
+    for clients in client_counts:
+        with tempfile.TemporaryDirectory(prefix='ims-serve-') as workdir:
+            data_dir = os.path.join(workdir, 'data')
+            rows = generate_data(data_dir, size, seed)
+            previous_dir = config.DATA_DIR
+            config.set_data_dir(data_dir)
+            try:
+                paid_before = _paid_total()
+            finally:
+                config.set_data_dir(previous_dir)
+
+            server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--port', '0', '--quiet',
+                                       '--data-dir', data_dir],
+                                      stdout=subprocess.PIPE, text=True)
+            try:
+                # The server prints its address once the tables are loaded.
+                started = time.perf_counter()
+                port = int(server.stdout.readline().rsplit(':', 1)[1])
+                warm_ms = (time.perf_counter() - started) * 1000
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(clients) as pool:
+                    outcomes = list(pool.map(lambda n: _serve_client(port, requests, rows, seed + n),
+                                             range(clients)))
+                elapsed = time.perf_counter() - started
+            finally:
+                server.terminate()
+                server.wait()
+
+            config.set_data_dir(data_dir)
+            try:
+                paid_after = _paid_total()
+            finally:
+                config.set_data_dir(previous_dir)
+
+            latencies = [ms for outcome in outcomes for ms in outcome[0]]
+            posted = sum(outcome[2] for outcome in outcomes)
+            results.append({
+                'size': size,
+                'clients': clients,
+                'requests_per_client': requests,
+                'startup_ms': round(warm_ms, 3),
+                'elapsed_s': round(elapsed, 3),
+                'requests_per_s': round(len(latencies) / elapsed, 1),
+                'p50_ms': round(_percentile(latencies, 0.5), 3),
+                'p95_ms': round(_percentile(latencies, 0.95), 3),
+                'p99_ms': round(_percentile(latencies, 0.99), 3),
+                'server_errors': sum(outcome[1] for outcome in outcomes),
+                'payments_posted': posted,
+                'lost_payments': posted - round(paid_after - paid_before),
+            })
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the installment management modules.")
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="comma-separated row counts (default: 1000,10000,100000)")
+    parser.add_argument('--repeat', type=int, default=5, help="timed calls per operation after the first")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', default='', help="comma-separated substrings of operation names to run")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--stress', default='',
+                        help="comma-separated process counts; runs the multiprocess stress test instead")
+    parser.add_argument('--stress-payments', type=int, default=200, help="payments posted by each stress process")
+    parser.add_argument('--serve', default='',
+                        help="comma-separated client counts; load-tests server.py instead")
+    parser.add_argument('--serve-requests', type=int, default=200, help="requests sent by each client")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    only = [part.strip() for part in args.only.split(',') if part.strip()]
+
+    report = {
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'datasets': [],
+        'results': [],
+    }
+    if args.serve:
+        client_counts = [int(count) for count in args.serve.split(',') if count.strip()]
+        report['serve'] = []
+        for size in sizes:
+            print(f"Load testing server.py on {size} rows with {args.serve} clients...", file=sys.stderr)
+            report['serve'].extend(run_serve(size, client_counts, args.serve_requests, args.seed))
+    elif args.stress:
+        process_counts = [int(count) for count in args.stress.split(',') if count.strip()]
+        report['stress'] = []
+        for size in sizes:
+            print(f"Stress testing {size} rows with {args.stress} processes...", file=sys.stderr)
+            report['stress'].extend(run_stress(size, process_counts, args.stress_payments, args.seed))
+    else:
+        print("Timing imports...", file=sys.stderr)
+        report['imports'] = measure_imports(args.repeat)
+        for size in sizes:
+            print(f"Benchmarking {size} rows...", file=sys.stderr)
+            dataset, results = run_size(size, args.repeat, args.seed, only)
+            report['datasets'].append(dataset)
+            report['results'].extend(results)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    # Any payment or customer lost under --stress or --serve fails the run.
+    checks = ('lost_payments', 'lost_customers', 'duplicate_customer_ids')
+    failed = False
+    for result in report.get('stress', []) + report.get('serve', []):
+        problems = [f"{name}={result[name]}" for name in checks if result.get(name)]
+        if problems:
+            failed = True
+            print(f"Check failed on {result['size']} rows: {', '.join(problems)}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
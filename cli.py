@@ -0,0 +1,366 @@
+# Non-interactive entry point for scripts and nightly jobs.
+#
+#   python cli.py customers add --name "Ali Khan" --phone 03001234567 --address Lahore
+#   python cli.py installments pay 12 1500
+#   python cli.py --format csv report balances --pending > balances.csv
+#   python cli.py batch jobs.txt             # one command per line; '-' reads stdin
+#   python cli.py --data-dir /backups/ims report portfolio
+#   python cli.py --format json export statements statements.json --payments
+#
+# Results are JSON (the default) or CSV on stdout, with rows holding the same
+# string values the data files do; errors go to stderr and the exit status is
+# 1 if any command failed. A batch runs every line against the tables loaded
+# once for the whole run, and posts each run of consecutive `installments pay`
+# lines with a single append to the ledger. Batch output is one record per
+# line of input: JSON Lines, or CSV with the command's rows JSON-encoded.
+# --format and --data-dir go before `batch` and apply to every line; a line
+# that gives them is rejected.
+
+import argparse
+import csv
+import json
+import shlex
+import sys
+
+import modules.analytics as analytics
+import modules.customer as customer
+import modules.export as export
+import modules.installment as installment
+import modules.product as product
+import modules.schedule as schedule
+from modules import config
+from modules.records import format_amount, format_date, parse_date
+
+class CommandError(Exception):
+    pass
+
+class Parser(argparse.ArgumentParser):
+    # Raises instead of exiting, so one bad line does not end a batch.
+    def error(self, message):
+        raise CommandError(message)
+
+def _done(success, message):
+    return success, message, None
+
+def _rows(records):
+    return [record.to_row() for record in records]
+
+def _amounts(values, names):
+    return {name: format_amount(value) if name in names else value for name, value in values.items()}
+
+def _due(entries, count):
+    return True, f"{count} installment(s)", [
+        dict(inst.to_row(), due_date=format_date(due_date), owed=format_amount(owed))
+        for due_date, inst, owed in entries
+    ]
+
+# Each command returns (success, message, rows or None).
+
+def customers_add(args):
+    return _done(*customer.add_customer(args.name, args.phone, args.address))
+
+def customers_get(args):
+    row, message = customer.search_customer(args.id)
+    return (True, "", [row.to_row()]) if row else (False, message, None)
+
+def customers_find(args):
+    rows, message = customer.find_customers(args.name, args.phone, args.address, args.exact, args.limit)
+    if not rows and not any(query and query.strip() for query in (args.name, args.phone, args.address)):
+        return False, message, None
+    return True, message, _rows(rows)
+
+def customers_update(args):
+    return _done(*customer.update_customer(args.id, args.name, args.phone, args.address))
+
+def customers_delete(args):
+    return _done(*customer.delete_customer(args.id, cascade=args.cascade))
+
+def products_add(args):
+    return _done(*product.add_product(args.name, args.price))
+
+def products_get(args):
+    row, message = product.search_product(args.id)
+    return (True, "", [row.to_row()]) if row else (False, message, None)
+
+def products_update(args):
+    return _done(*product.update_product(args.id, args.name, args.price))
+
+def products_delete(args):
+    return _done(*product.delete_product(args.id, cascade=args.cascade))
+
+def installments_create(args):
+    return _done(*installment.create_installment(args.customer, args.product, args.paid,
+                                                 args.months, args.start_date))
+
+def installments_get(args):
+    row, message = installment.search_installment(args.id)
+    return (True, "", [row.to_row()]) if row else (False, message, None)
+
+def installments_pay(args):
+    return _done(*installment.make_payment(args.id, args.amount))
+
+def installments_history(args):
+    rows, message = installment.get_payment_history(args.id)
+    return (False, message, None) if message else (True, "", _rows(rows))
+
+def report_balances(args):
+    # Per customer with installments: contracts, amounts and collection ratio.
+    rows = []
+    for customer_id, totals in sorted(analytics.customer_exposure().items()):
+        if args.pending and not totals['outstanding']:
+            continue
+        record = customer.customers_table.get(customer_id)
+        rows.append(dict({'customer_id': customer_id, 'name': record.name if record else ''},
+                         **_amounts(totals, ('total', 'paid', 'outstanding'))))
+    return True, f"{len(rows)} customer(s)", rows
+
+def report_products(args):
+    rows = []
+    for product_id, totals in sorted(analytics.product_exposure().items()):
+        record = product.products_table.get(product_id)
+        rows.append(dict({'product_id': product_id, 'product_name': record.product_name if record else ''},
+                         **_amounts(totals, ('total', 'paid', 'outstanding'))))
+    return True, f"{len(rows)} product(s)", rows
+
+def report_portfolio(args):
+    return True, "", [_amounts(analytics.portfolio_summary(), ('total', 'paid', 'outstanding'))]
+
+def report_overdue(args):
+    return _due(*schedule.overdue_installments(limit=args.limit))
+
+def report_due(args):
+    return _due(*schedule.due_installments(args.days, limit=args.limit))
+
+def export_statements(args):
+    return _done(*export.export_report('statements', args.output, args.format, today=args.date,
+                                       include_payments=args.payments, include_empty=args.all))
+
+def export_balances(args):
+    return _done(*export.export_report('balances', args.output, args.format, today=args.date,
+                                       min_days_overdue=args.min_days_overdue))
+
+def export_products(args):
+    return _done(*export.export_report('products', args.output, args.format))
+
+def _date(text):
+    try:
+        return parse_date(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date: {text!r}")
+
+def build_parser(batch_line=False):
+    # With batch_line, the parser for one line of a batch: the commands
+    # without the global options, which only apply to the whole run.
+    parser = Parser(prog='cli.py', description="Run installment management commands without the menus.")
+    if not batch_line:
+        parser.add_argument('--format', choices=('json', 'csv'), default='json',
+                            help="output format (default: json)")
+        parser.add_argument('--data-dir', help="directory holding the data files (default: data/ or IMS_DATA_DIR)")
+    groups = parser.add_subparsers(dest='group', required=True)
+
+    def command(group, name, func, help):
+        sub = group.add_parser(name, help=help)
+        sub.set_defaults(func=func)
+        return sub
+
+    customers = groups.add_parser('customers', help="add, view, find, update or delete customers")
+    customers = customers.add_subparsers(dest='command', required=True)
+    sub = command(customers, 'add', customers_add, "add a customer")
+    sub.add_argument('--name', required=True)
+    sub.add_argument('--phone', required=True)
+    sub.add_argument('--address', required=True)
+    command(customers, 'get', customers_get, "show one customer").add_argument('id')
+    sub = command(customers, 'find', customers_find, "search by name, phone or address")
+    sub.add_argument('--name')
+    sub.add_argument('--phone')
+    sub.add_argument('--address')
+    sub.add_argument('--exact', action='store_true', help="match whole values")
+    sub.add_argument('--limit', type=int)
+    sub = command(customers, 'update', customers_update, "change a customer's details")
+    sub.add_argument('id')
+    sub.add_argument('--name')
+    sub.add_argument('--phone')
+    sub.add_argument('--address')
+    sub = command(customers, 'delete', customers_delete, "delete a customer")
+    sub.add_argument('id')
+    sub.add_argument('--cascade', action='store_true', help="archive the customer's installments too")
+
+    products = groups.add_parser('products', help="add, view, update or delete products")
+    products = products.add_subparsers(dest='command', required=True)
+    sub = command(products, 'add', products_add, "add a product")
+    sub.add_argument('--name', required=True)
+    sub.add_argument('--price', required=True)
+    command(products, 'get', products_get, "show one product").add_argument('id')
+    sub = command(products, 'update', products_update, "change a product's name or price")
+    sub.add_argument('id')
+    sub.add_argument('--name')
+    sub.add_argument('--price')
+    sub = command(products, 'delete', products_delete, "delete a product")
+    sub.add_argument('id')
+    sub.add_argument('--cascade', action='store_true', help="archive the product's installments too")
+
+    installments = groups.add_parser('installments', help="create installments and post payments")
+    installments = installments.add_subparsers(dest='command', required=True)
+    sub = command(installments, 'create', installments_create, "sell a product on installments")
+    sub.add_argument('--customer', required=True)
+    sub.add_argument('--product', required=True)
+    sub.add_argument('--paid', required=True, help="down payment")
+    sub.add_argument('--months')
+    sub.add_argument('--start-date', help="first due date, YYYY-MM-DD")
+    command(installments, 'get', installments_get, "show one installment").add_argument('id')
+    sub = command(installments, 'pay', installments_pay, "post a payment")
+    sub.add_argument('id')
+    sub.add_argument('amount')
+    command(installments, 'history', installments_history, "list an installment's payments").add_argument('id')
+
+    report = groups.add_parser('report', help="portfolio reports")
+    report = report.add_subparsers(dest='command', required=True)
+    sub = command(report, 'balances', report_balances, "totals and balance per customer")
+    sub.add_argument('--pending', action='store_true', help="only customers with an outstanding balance")
+    command(report, 'products', report_products, "totals and exposure per product")
+    command(report, 'portfolio', report_portfolio, "summary of the whole book")
+    sub = command(report, 'overdue', report_overdue, "installments past their due date")
+    sub.add_argument('--limit', type=int)
+    sub = command(report, 'due', report_due, "installments falling due soon")
+    sub.add_argument('--days', type=int, default=7)
+    sub.add_argument('--limit', type=int)
+
+    exports = groups.add_parser('export', help="write a report to a CSV or JSON file (see --format)")
+    exports = exports.add_subparsers(dest='command', required=True)
+    sub = command(exports, 'statements', export_statements, "a statement for every customer")
+    sub.add_argument('output')
+    sub.add_argument('--payments', action='store_true', help="include each contract's payments (JSON only)")
+    sub.add_argument('--all', action='store_true', help="include customers without installments")
+    sub.add_argument('--date', type=_date, help="statement date, YYYY-MM-DD (default: today)")
+    sub = command(exports, 'balances', export_balances, "outstanding balances with aging")
+    sub.add_argument('output')
+    sub.add_argument('--min-days-overdue', type=int, default=0)
+    sub.add_argument('--date', type=_date, help="aging date, YYYY-MM-DD (default: today)")
+    command(exports, 'products', export_products, "exposure per product").add_argument('output')
+
+    if not batch_line:
+        sub = groups.add_parser('batch', help="run one command per line from a file or stdin")
+        sub.add_argument('file', help="file of commands, or - for stdin")
+        sub.set_defaults(func=None)
+    return parser
+
+def write_rows(rows, output_format, out):
+    if output_format == 'json':
+        json.dump(rows, out, indent=2)
+        out.write("\n")
+        return
+    columns = list(dict.fromkeys(name for row in rows for name in row))
+    writer = csv.DictWriter(out, fieldnames=columns, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+
+def run(args, out, err):
+    # A single command: its rows, or its message when it returns none.
+    success, message, rows = args.func(args)
+    if not success:
+        print(message, file=err)
+    elif rows is not None:
+        write_rows(rows, args.format, out)
+    elif message:
+        print(message, file=out)
+    return success
+
+def _read_commands(file):
+    # (line_number, argv) for every non-blank line that is not a # comment.
+    source = sys.stdin if file == '-' else open(file, encoding='utf-8')
+    try:
+        for line_number, line in enumerate(source, start=1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line_number, line
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+def _parse(parser, line):
+    try:
+        argv = shlex.split(line)
+        option = argv[0].split('=')[0] if argv else ''
+        if option in ('--format', '--data-dir'):
+            return None, f"Invalid command: {option} applies to the whole batch, not one line"
+        args = parser.parse_args(argv)
+    except (CommandError, ValueError) as e:
+        return None, f"Invalid command: {e}"
+    except SystemExit:
+        # --help
+        return None, "Invalid command"
+    return args, ""
+
+def _post(pending):
+    # Runs consecutive payments as one post_payments call.
+    posted, failures = installment.post_payments((args.id, args.amount) for _, _, args in pending)
+    failed = {row_number: message for row_number, _, message in failures}
+    for n, (line_number, line, _) in enumerate(pending, start=1):
+        if n in failed:
+            yield line_number, line, False, failed[n], None
+        else:
+            yield line_number, line, True, "Payment posted", None
+
+def run_batch(parser, file):
+    # (line_number, command, success, message, rows) for every command, in
+    # order.
+    pending = []
+    for line_number, line in _read_commands(file):
+        args, message = _parse(parser, line)
+        if args is not None and args.func is installments_pay:
+            pending.append((line_number, line, args))
+            continue
+        if pending:
+            yield from _post(pending)
+            pending = []
+        if args is None:
+            yield line_number, line, False, message, None
+        else:
+            yield (line_number, line) + args.func(args)
+    if pending:
+        yield from _post(pending)
+
+def write_batch(results, output_format, out, err):
+    all_ok = True
+    writer = None
+    if output_format == 'csv':
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(['line', 'command', 'ok', 'message', 'rows'])
+    for line_number, line, success, message, rows in results:
+        all_ok = all_ok and success
+        if not success:
+            print(f"Line {line_number}: {message}", file=err)
+        if writer:
+            writer.writerow([line_number, line, int(success), message, '' if rows is None else json.dumps(rows)])
+        else:
+            record = {'line': line_number, 'command': line, 'ok': success, 'message': message}
+            if rows is not None:
+                record['rows'] = rows
+            out.write(json.dumps(record) + "\n")
+    return all_ok
+
+def main(argv=None, out=sys.stdout, err=sys.stderr):
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+    except CommandError as e:
+        parser.print_usage(err)
+        print(f"{parser.prog}: error: {e}", file=err)
+        return 2
+
+    if args.data_dir:
+        config.set_data_dir(args.data_dir)
+    if args.func is None:
+        lines = build_parser(batch_line=True)
+        lines.set_defaults(format=args.format)
+        try:
+            success = write_batch(run_batch(lines, args.file), args.format, out, err)
+        except OSError as e:
+            print(f"Cannot read {args.file}: {e}", file=err)
+            return 2
+    else:
+        success = run(args, out, err)
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
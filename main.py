@@ -1,6 +1,23 @@
+import csv
 import modules.customer as customer
 import modules.product as product
 import modules.installment as installment
+import modules.analytics as analytics
+import modules.export as export
+import modules.integrity as integrity
+import modules.schedule as schedule
+import modules.stats as stats
+from modules.records import format_amount, format_date
+
+PAGE_SIZE = 20
+
+def browse_pages(view, **filters):
+    offset = 0
+    while view(offset=offset, limit=PAGE_SIZE, **filters):
+        more = input("Press Enter for next page, q to stop: ").strip().lower()
+        if more == 'q':
+            break
+        offset += PAGE_SIZE
 
 def print_start_menu():
     print("\n" + "="*60)
@@ -18,7 +35,10 @@ def print_admin_menu():
     print("1. Customer Management")
     print("2. Product Management")
     print("3. Installment Management")
-    print("4. Back to Start")
+    print("4. Portfolio Report")
+    print("5. Export Reports")
+    print("6. Diagnostics")
+    print("7. Back to Start")
     print("-"*60)
 
 def print_customer_view_menu():
@@ -41,10 +61,12 @@ def customer_menu():
         print("3. Search Customer")
         print("4. Update Customer")
         print("5. Delete Customer")
-        print("6. Back to Main Menu")
+        print("6. Import Customers From File")
+        print("7. Find Customers By Name/Phone/Address")
+        print("8. Back to Main Menu")
         print("-"*60)
         
-        choice = input("Enter choice (1-6): ").strip()
+        choice = input("Enter choice (1-8): ").strip()
         
         if choice == '1':
             print("\n--- Add Customer ---")
@@ -65,10 +87,10 @@ def customer_menu():
             cust, message = customer.search_customer(customer_id)
             
             if cust:
-                print(f"\nID: {cust['customer_id']}")
-                print(f"Name: {cust['name']}")
-                print(f"Phone: {cust['phone']}")
-                print(f"Address: {cust['address']}")
+                print(f"\nID: {cust.customer_id}")
+                print(f"Name: {cust.name}")
+                print(f"Phone: {cust.phone}")
+                print(f"Address: {cust.address}")
             else:
                 print(f"✗ {message}")
         
@@ -85,15 +107,50 @@ def customer_menu():
         elif choice == '5':
             print("\n--- Delete Customer ---")
             customer_id = input("Enter customer ID: ").strip()
+            contracts, _ = installment.get_customer_installments(customer_id)
+            if contracts:
+                print(f"Customer has {len(contracts)} installment(s); deleting will archive them")
             confirm = input("Confirm (yes/no): ").strip().lower()
             
             if confirm == 'yes':
-                success, message = customer.delete_customer(customer_id)
+                success, message = customer.delete_customer(customer_id, cascade=bool(contracts))
                 print(f"✓ {message}" if success else f"✗ {message}")
             else:
                 print("✗ Cancelled")
         
         elif choice == '6':
+            print("\n--- Import Customers From File ---")
+            print("File must be a CSV with columns: name,phone,address")
+            filepath = input("Enter file path: ").strip()
+            
+            try:
+                imported, rejected = customer.import_customers(filepath)
+            except (OSError, UnicodeDecodeError, csv.Error):
+                print(f"✗ Could not read {filepath}")
+                continue
+            
+            print(f"✓ {imported} customer(s) imported")
+            for row_number, message in rejected:
+                print(f"✗ Row {row_number}: {message}")
+        
+        elif choice == '7':
+            print("\n--- Find Customers ---")
+            name = input("Name starts with (blank to skip): ").strip() or None
+            phone = input("Phone starts with (blank to skip): ").strip() or None
+            address = input("Address starts with (blank to skip): ").strip() or None
+            matches, message = customer.find_customers(name, phone, address, limit=PAGE_SIZE + 1)
+            
+            if matches:
+                print(f"{'ID':<5} {'Name':<20} {'Phone':<15} {'Address':<30}")
+                print("-"*80)
+                for cust in matches[:PAGE_SIZE]:
+                    print(f"{cust.customer_id:<5} {cust.name:<20} {cust.phone:<15} {cust.address:<30}")
+                if len(matches) > PAGE_SIZE:
+                    print(f"Showing the first {PAGE_SIZE} matches; narrow the search to see others")
+            else:
+                print(f"✗ {message}")
+        
+        elif choice == '8':
             break
         else:
             print("✗ Invalid choice")
@@ -108,10 +165,11 @@ def product_menu():
         print("3. Search Product")
         print("4. Update Product")
         print("5. Delete Product")
-        print("6. Back to Main Menu")
+        print("6. Import Products From File")
+        print("7. Back to Main Menu")
         print("-"*60)
         
-        choice = input("Enter choice (1-6): ").strip()
+        choice = input("Enter choice (1-7): ").strip()
         
         if choice == '1':
             print("\n--- Add Product ---")
@@ -131,9 +189,9 @@ def product_menu():
             prod, message = product.search_product(product_id)
             
             if prod:
-                print(f"\nID: {prod['product_id']}")
-                print(f"Name: {prod['product_name']}")
-                print(f"Price: {prod['price']}")
+                print(f"\nID: {prod.product_id}")
+                print(f"Name: {prod.product_name}")
+                print(f"Price: {format_amount(prod.price)}")
             else:
                 print(f"✗ {message}")
         
@@ -149,15 +207,33 @@ def product_menu():
         elif choice == '5':
             print("\n--- Delete Product ---")
             product_id = input("Enter product ID: ").strip()
+            contracts, _ = installment.get_product_installments(product_id)
+            if contracts:
+                print(f"Product has {len(contracts)} installment(s); deleting will archive them")
             confirm = input("Confirm (yes/no): ").strip().lower()
             
             if confirm == 'yes':
-                success, message = product.delete_product(product_id)
+                success, message = product.delete_product(product_id, cascade=bool(contracts))
                 print(f"✓ {message}" if success else f"✗ {message}")
             else:
                 print("✗ Cancelled")
         
         elif choice == '6':
+            print("\n--- Import Products From File ---")
+            print("File must be a CSV with columns: product_name,price")
+            filepath = input("Enter file path: ").strip()
+            
+            try:
+                imported, rejected = product.import_products(filepath)
+            except (OSError, UnicodeDecodeError, csv.Error):
+                print(f"✗ Could not read {filepath}")
+                continue
+            
+            print(f"✓ {imported} product(s) imported")
+            for row_number, message in rejected:
+                print(f"✗ Row {row_number}: {message}")
+        
+        elif choice == '7':
             break
         else:
             print("✗ Invalid choice")
@@ -173,18 +249,27 @@ def installment_menu():
         print("4. Make Payment")
         print("5. Customer Total Balance")
         print("6. Customer Installments")
-        print("7. Back to Main Menu")
+        print("7. Post Payments From File")
+        print("8. Overdue Installments")
+        print("9. Due In Next 7 Days")
+        print("10. Payment History")
+        print("11. Back to Main Menu")
         print("-"*60)
         
-        choice = input("Enter choice (1-7): ").strip()
+        choice = input("Enter choice (1-11): ").strip()
         
         if choice == '1':
             print("\n--- Create Installment ---")
             customer_id = input("Enter customer ID: ").strip()
             product_id = input("Enter product ID: ").strip()
             paid_amount = input("Enter paid amount: ").strip()
+            months = input("Enter number of monthly installments (blank for none): ").strip() or None
+            start_date = None
+            if months:
+                start_date = input("Enter first due date YYYY-MM-DD (blank for one month from today): ").strip() or None
             
-            success, message = installment.create_installment(customer_id, product_id, paid_amount)
+            success, message = installment.create_installment(customer_id, product_id, paid_amount,
+                                                              months, start_date)
             print(f"✓ {message}" if success else f"✗ {message}")
         
         elif choice == '2':
@@ -197,15 +282,22 @@ def installment_menu():
             inst, message = installment.search_installment(installment_id)
             
             if inst:
-                print(f"\nInstallment ID: {inst['installment_id']}")
-                print(f"Customer ID: {inst['customer_id']}")
-                print(f"Product ID: {inst['product_id']}")
-                print(f"Total Price: {inst['total_price']}")
-                print(f"Paid Amount: {inst['paid_amount']}")
-                print(f"Remaining: {inst['remaining_amount']}")
-                remaining = float(inst['remaining_amount'])
-                status = "FULLY PAID" if remaining == 0 else "PENDING"
+                print(f"\nInstallment ID: {inst.installment_id}")
+                print(f"Customer ID: {inst.customer_id}")
+                print(f"Product ID: {inst.product_id}")
+                print(f"Total Price: {format_amount(inst.total_price)}")
+                print(f"Paid Amount: {format_amount(inst.paid_amount)}")
+                print(f"Remaining: {format_amount(inst.remaining_amount)}")
+                status = "FULLY PAID" if inst.fully_paid else "PENDING"
                 print(f"Status: {status}")
+                
+                plan = schedule.payment_schedule(inst)
+                if plan:
+                    print(f"\n{'#':<4} {'Due Date':<12} {'Amount':<12} {'Owed':<12}")
+                    print("-"*40)
+                    for number, due_date, amount, owed in plan:
+                        print(f"{number:<4} {format_date(due_date):<12} {format_amount(amount):<12} "
+                              f"{format_amount(owed):<12}")
             else:
                 print(f"✗ {message}")
         
@@ -223,7 +315,7 @@ def installment_menu():
             balance, message = installment.get_customer_total_balance(customer_id)
             
             if message == "":
-                print(f"✓ Total Balance: {balance}")
+                print(f"✓ Total Balance: {format_amount(balance)}")
             else:
                 print(f"✗ {message}")
         
@@ -237,19 +329,161 @@ def installment_menu():
                 print("-"*60)
                 
                 for inst in installations:
-                    remaining = float(inst['remaining_amount'])
-                    status = "FULLY PAID" if remaining == 0 else "PENDING"
+                    status = "FULLY PAID" if inst.fully_paid else "PENDING"
                     
-                    print(f"{inst['installment_id']:<5} {inst['product_id']:<5} {inst['total_price']:<12} "
-                          f"{inst['paid_amount']:<12} {inst['remaining_amount']:<12} {status:<15}")
+                    print(f"{inst.installment_id:<5} {inst.product_id:<5} {format_amount(inst.total_price):<12} "
+                          f"{format_amount(inst.paid_amount):<12} {format_amount(inst.remaining_amount):<12} {status:<15}")
             else:
                 print(f"✗ {message}")
         
         elif choice == '7':
+            print("\n--- Post Payments From File ---")
+            print("File must be a CSV with columns: installment_id,amount")
+            filepath = input("Enter file path: ").strip()
+            
+            try:
+                posted, failures = installment.post_payments(installment.load_payment_file(filepath))
+            except (OSError, UnicodeDecodeError, csv.Error):
+                print(f"✗ Could not read {filepath}")
+                continue
+            
+            print(f"✓ {posted} payment(s) posted")
+            for row_number, installment_id, message in failures:
+                print(f"✗ Row {row_number} (installment {installment_id}): {message}")
+        
+        elif choice in ('8', '9'):
+            if choice == '8':
+                print("\n--- Overdue Installments ---")
+                entries, count = schedule.overdue_installments(limit=PAGE_SIZE)
+            else:
+                print("\n--- Due In Next 7 Days ---")
+                entries, count = schedule.due_installments(7, limit=PAGE_SIZE)
+            
+            if entries:
+                print(f"{'Due Date':<12} {'ID':<5} {'Cust':<5} {'Owed':<12} {'Remaining':<12}")
+                print("-"*60)
+                for due_date, inst, owed in entries:
+                    print(f"{format_date(due_date):<12} {inst.installment_id:<5} {inst.customer_id:<5} "
+                          f"{format_amount(owed):<12} {format_amount(inst.remaining_amount):<12}")
+                if count > len(entries):
+                    print(f"... and {count - len(entries)} more")
+            else:
+                print("No installments found")
+        
+        elif choice == '10':
+            print("\n--- Payment History ---")
+            installment_id = input("Enter installment ID: ").strip()
+            payments, message = installment.get_payment_history(installment_id)
+            
+            if message:
+                print(f"✗ {message}")
+            elif payments:
+                print(f"{'Payment':<10} {'Date':<22} {'Amount':<12}")
+                print("-"*45)
+                for payment in payments:
+                    print(f"{payment.payment_id:<10} {payment.timestamp.isoformat(sep=' '):<22} "
+                          f"{format_amount(payment.amount):<12}")
+            else:
+                print("No payments recorded")
+        
+        elif choice == '11':
             break
         else:
             print("✗ Invalid choice")
 
+def diagnostics_menu():
+    while True:
+        print("\n" + "="*60)
+        print("      DIAGNOSTICS")
+        print("="*60)
+        state = "ON" if stats.is_enabled() else "OFF"
+        print(f"1. Turn Instrumentation {'Off' if stats.is_enabled() else 'On'} (currently {state})")
+        print("2. Operation Stats")
+        print("3. File I/O Stats")
+        print("4. Reset Stats")
+        print("5. Check Data Integrity")
+        print("6. Back to Admin Panel")
+        print("-"*60)
+        
+        choice = input("Enter choice (1-6): ").strip()
+        
+        if choice == '1':
+            if stats.is_enabled():
+                stats.disable()
+                print("✓ Instrumentation turned off")
+            else:
+                stats.enable()
+                print("✓ Instrumentation turned on")
+        
+        elif choice == '2':
+            operations = stats.operation_stats()
+            if not operations:
+                print("No operations recorded")
+                continue
+            
+            print("\n" + "="*120)
+            print(f"{'Operation':<40} {'Calls':<7} {'Avg ms':<10} {'Max ms':<10} {'Reads':<7} {'Writes':<7} "
+                  f"{'KB read':<10} {'KB written':<11} {'Rows':<10}")
+            print("="*120)
+            for name, op in sorted(operations.items(), key=lambda item: -item[1]['total_ms']):
+                print(f"{name:<40} {op['calls']:<7} {op['total_ms'] / op['calls']:<10.3f} {op['max_ms']:<10.3f} "
+                      f"{op['reads']:<7} {op['writes']:<7} {op['bytes_read'] / 1024:<10.1f} "
+                      f"{op['bytes_written'] / 1024:<11.1f} {op['rows_parsed']:<10}")
+            print("="*120)
+        
+        elif choice == '3':
+            files = stats.file_stats()
+            if not files:
+                print("No file I/O recorded")
+                continue
+            
+            print("\n" + "="*90)
+            print(f"{'File':<30} {'Reads':<8} {'Writes':<8} {'KB read':<12} {'KB written':<12} {'Rows':<10}")
+            print("="*90)
+            for filepath, io in sorted(files.items()):
+                print(f"{filepath:<30} {io['reads']:<8} {io['writes']:<8} {io['bytes_read'] / 1024:<12.1f} "
+                      f"{io['bytes_written'] / 1024:<12.1f} {io['rows_parsed']:<10}")
+            print("="*90)
+        
+        elif choice == '4':
+            stats.reset()
+            print("✓ Stats reset")
+        
+        elif choice == '5':
+            problems = integrity.check_integrity()
+            if not problems:
+                print("✓ No problems found")
+            for filename, row_number, message in problems:
+                print(f"✗ {filename} row {row_number}: {message}")
+        
+        elif choice == '6':
+            break
+        else:
+            print("✗ Invalid choice")
+
+def export_menu():
+    print("\n--- Export Reports ---")
+    print("1. Customer Statements")
+    print("2. Outstanding Balances (with aging)")
+    print("3. Product Exposure")
+    report = {'1': 'statements', '2': 'balances', '3': 'products'}.get(input("Enter choice (1-3): ").strip())
+    if not report:
+        print("✗ Invalid choice")
+        return
+    
+    fmt = input("Format (csv/json) [csv]: ").strip().lower() or 'csv'
+    filepath = input("Enter output file path: ").strip()
+    if not filepath:
+        print("✗ No file path given")
+        return
+    
+    options = {}
+    if report == 'statements' and fmt == 'json':
+        options['include_payments'] = input("Include payment history? (y/n): ").strip().lower() == 'y'
+    
+    success, message = export.export_report(report, filepath, fmt, **options)
+    print(f"✓ {message}" if success else f"✗ {message}")
+
 def main():
     while True:
         print_start_menu()
@@ -270,7 +504,7 @@ def main():
 def admin_panel():
     while True:
         print_admin_menu()
-        choice = input("Enter choice (1-4): ").strip()
+        choice = input("Enter choice (1-7): ").strip()
         
         if choice == '1':
             customer_menu()
@@ -279,6 +513,12 @@ def admin_panel():
         elif choice == '3':
             installment_menu()
         elif choice == '4':
+            analytics.print_portfolio_report()
+        elif choice == '5':
+            export_menu()
+        elif choice == '6':
+            diagnostics_menu()
+        elif choice == '7':
             break
         else:
             print("✗ Invalid choice")
@@ -290,15 +530,17 @@ def customer_panel():
         
         if choice == '1':
             print("\n--- All Customers ---")
-            customer.view_all_customers()
+            city = input("Filter by city (blank for all): ").strip() or None
+            browse_pages(customer.view_all_customers, city=city)
         
         elif choice == '2':
             print("\n--- All Products ---")
-            product.view_all_products()
+            browse_pages(product.view_all_products)
         
         elif choice == '3':
             print("\n--- All Installments ---")
-            installment.view_all_installments()
+            pending_only = input("Pending only? (yes/no): ").strip().lower() == 'yes'
+            browse_pages(installment.view_all_installments, pending_only=pending_only)
         
         elif choice == '4':
             break
@@ -0,0 +1,247 @@
+from array import array
+from modules.installment import installments_table
+from modules.records import format_amount
+from modules.stats import instrumented
+
+# Portfolio figures computed over the installments held column by column:
+# one array per field instead of one object per contract. The columns and the
+# per-product, per-customer and per-bucket sums are built from
+# installments_table once per reload (with NumPy group-bys when it is
+# installed) and then patched in place from its change notifications, the way
+# installment.py keeps its running totals, so a report costs a few passes over
+# flat arrays plus one entry per group rather than a loop over every contract.
+#
+# Amounts are in paisa, like the records they come from. A deleted contract
+# keeps its slot with `live` cleared and its amounts zeroed, so positions stay
+# stable until the next rebuild.
+
+COLUMNS = ('installment_id', 'customer_id', 'product_id', 'total_price', 'paid_amount', 'remaining_amount')
+AMOUNTS = ('total_price', 'paid_amount', 'remaining_amount')
+GROUPS = ('product_id', 'customer_id')
+
+# Collection progress buckets: (label, upper bound of the paid share). A
+# pending contract falls in the first bucket whose bound exceeds its share.
+BUCKETS = (
+    ('Not started', 0.0),
+    ('Under 25%', 0.25),
+    ('25-50%', 0.5),
+    ('50-75%', 0.75),
+    ('75-100%', 1.0),
+    ('Fully paid', None),
+)
+
+_columns = {}
+_live = array('b')
+_position = {}
+# column -> {key: [contracts, total, paid, outstanding]}
+_groups = {column: {} for column in GROUPS}
+# bucket index -> [contracts, outstanding]
+_buckets = []
+_generation = None
+# NumPy when installed, else None; it takes longer to import than the rest of
+# the program, so that waits for the first rebuild.
+_numpy = False
+
+def _load_numpy():
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+def _bucket(total, paid, remaining):
+    if remaining == 0:
+        return len(BUCKETS) - 1
+    if paid == 0:
+        return 0
+    share = paid / total if total else 1.0
+    for n, (_, upper) in enumerate(BUCKETS[1:-1], start=1):
+        if share < upper:
+            return n
+    return len(BUCKETS) - 2
+
+def _apply(total, paid, remaining, keys, sign):
+    for column, key in zip(GROUPS, keys):
+        group = _groups[column].get(key)
+        if group is None:
+            group = _groups[column][key] = [0, 0, 0, 0]
+        group[0] += sign
+        group[1] += sign * total
+        group[2] += sign * paid
+        group[3] += sign * remaining
+        if group[0] == 0:
+            del _groups[column][key]
+    bucket = _buckets[_bucket(total, paid, remaining)]
+    bucket[0] += sign
+    bucket[1] += sign * remaining
+
+def _apply_record(inst, sign):
+    _apply(inst.total_price, inst.paid_amount, inst.remaining_amount,
+           [getattr(inst, column) for column in GROUPS], sign)
+
+def _rebuild_groups():
+    _buckets[:] = [[0, 0] for _ in BUCKETS]
+    for groups in _groups.values():
+        groups.clear()
+    numpy = _load_numpy()
+    if numpy is None or not len(_live):
+        for row in zip(*(_columns[column] for column in AMOUNTS + GROUPS)):
+            _apply(row[0], row[1], row[2], row[3:], 1)
+        return
+
+    # Sums stay in int64 throughout: bincount's weights would go through
+    # float64, which is not exact for paisa totals past 2**53.
+    amounts = [numpy.frombuffer(_columns[column], dtype=numpy.int64) for column in AMOUNTS]
+    for column in GROUPS:
+        # Rows sorted by key; each group is then one run, summed by reduceat.
+        values = numpy.frombuffer(_columns[column], dtype=numpy.int64)
+        order = numpy.argsort(values, kind='stable')
+        ordered = values[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], ordered[1:] != ordered[:-1])))
+        counts = numpy.diff(numpy.append(starts, len(ordered)))
+        sums = [counts] + [numpy.add.reduceat(a[order], starts) for a in amounts]
+        _groups[column].update(
+            (key, list(group)) for key, group in zip(ordered[starts].tolist(), zip(*(s.tolist() for s in sums)))
+        )
+
+    # The same buckets as _bucket(), for every contract at once.
+    total, paid, remaining = amounts
+    share = numpy.divide(paid, total, out=numpy.ones(len(total)), where=total != 0)
+    uppers = numpy.array([upper for _, upper in BUCKETS[1:-1]])
+    middle = 1 + numpy.minimum(numpy.searchsorted(uppers, share, side='right'), len(uppers) - 1)
+    index = numpy.where(remaining == 0, len(BUCKETS) - 1, numpy.where(paid == 0, 0, middle))
+    counts = numpy.bincount(index, minlength=len(BUCKETS)).tolist()
+    for n, bucket in enumerate(_buckets):
+        bucket[0] = counts[n]
+        bucket[1] = int(remaining[index == n].sum())
+
+def _rebuild():
+    global _live, _generation
+    rows = installments_table.rows()
+    for column in COLUMNS:
+        _columns[column] = array('q', [getattr(inst, column) for inst in rows])
+    _live = array('b', [1]) * len(rows)
+    _position.clear()
+    _position.update((inst_id, n) for n, inst_id in enumerate(_columns['installment_id']))
+    _rebuild_groups()
+    _generation = installments_table.generation
+
+def _current():
+    installments_table.refresh()
+    if _generation != installments_table.generation:
+        _rebuild()
+
+def _on_installment_change(old, new):
+    if _generation != installments_table.generation:
+        return
+    if old is not None:
+        _apply_record(old, -1)
+    if new is not None:
+        _apply_record(new, 1)
+
+    if new is None:
+        n = _position.pop(old.installment_id, None)
+        if n is not None:
+            _live[n] = 0
+            for column in AMOUNTS:
+                _columns[column][n] = 0
+        return
+    n = _position.get(new.installment_id)
+    if n is None:
+        _position[new.installment_id] = len(_live)
+        _live.append(1)
+        for column in COLUMNS:
+            _columns[column].append(getattr(new, column))
+    else:
+        for column in COLUMNS:
+            _columns[column][n] = getattr(new, column)
+
+installments_table.subscribe(_on_installment_change)
+
+def _ratio(part, whole):
+    return part / whole if whole else 0.0
+
+def _grouped(column):
+    report = {}
+    for key, (count, total, paid, outstanding) in _groups[column].items():
+        report[key] = {
+            'contracts': count,
+            'total': total,
+            'paid': paid,
+            'outstanding': outstanding,
+            'collection_ratio': _ratio(paid, total),
+        }
+    return report
+
+@instrumented
+def portfolio_summary():
+    _current()
+    contracts = sum(_live)
+    total = sum(_columns['total_price'])
+    paid = sum(_columns['paid_amount'])
+    fully_paid = _buckets[-1][0]
+    return {
+        'contracts': contracts,
+        'total': total,
+        'paid': paid,
+        'outstanding': sum(_columns['remaining_amount']),
+        'collection_ratio': _ratio(paid, total),
+        'pending': contracts - fully_paid,
+        'fully_paid': fully_paid,
+    }
+
+@instrumented
+def collection_buckets():
+    # Contracts and outstanding balance per collection progress bucket.
+    _current()
+    return {label: {'contracts': count, 'outstanding': outstanding}
+            for (label, _), (count, outstanding) in zip(BUCKETS, _buckets)}
+
+@instrumented
+def product_exposure():
+    # Per product: contracts, amounts, collection ratio and its share of the
+    # whole book's outstanding balance.
+    _current()
+    report = _grouped('product_id')
+    outstanding = sum(_columns['remaining_amount'])
+    for product in report.values():
+        product['exposure'] = _ratio(product['outstanding'], outstanding)
+    return report
+
+@instrumented
+def customer_exposure():
+    _current()
+    return _grouped('customer_id')
+
+def print_portfolio_report(top=10):
+    summary = portfolio_summary()
+    if not summary['contracts']:
+        print("No installments found")
+        return
+
+    print("\n" + "="*60)
+    print("      PORTFOLIO SUMMARY")
+    print("="*60)
+    print(f"Contracts:        {summary['contracts']} ({summary['pending']} pending, {summary['fully_paid']} fully paid)")
+    print(f"Total Sold:       {format_amount(summary['total'])}")
+    print(f"Collected:        {format_amount(summary['paid'])}")
+    print(f"Outstanding:      {format_amount(summary['outstanding'])}")
+    print(f"Collection Ratio: {summary['collection_ratio']:.1%}")
+
+    print("\n" + "-"*60)
+    print(f"{'Collected':<15} {'Contracts':<12} {'Outstanding':<15}")
+    print("-"*60)
+    for label, bucket in collection_buckets().items():
+        print(f"{label:<15} {bucket['contracts']:<12} {format_amount(bucket['outstanding']):<15}")
+
+    products = sorted(product_exposure().items(), key=lambda item: -item[1]['outstanding'])
+    print("\n" + "-"*60)
+    print(f"{'Product':<10} {'Contracts':<12} {'Outstanding':<15} {'Exposure':<10} {'Collected':<10}")
+    print("-"*60)
+    for product_id, product in products[:top]:
+        print(f"{product_id:<10} {product['contracts']:<12} {format_amount(product['outstanding']):<15} "
+              f"{product['exposure']:<10.1%} {product['collection_ratio']:<10.1%}")
+    print("="*60)
@@ -0,0 +1,39 @@
+import os
+
+# Directory holding the data files: data/ next to main.py unless IMS_DATA_DIR
+# (or set_data_dir) says otherwise, so the program finds its files from any
+# working directory and separate runs can each point at their own set. Paths
+# are resolved when a file is used, not at import, so changing it takes
+# effect on the next access.
+DATA_DIR = os.path.abspath(os.environ.get('IMS_DATA_DIR') or
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+
+# Where modules.file_handler keeps the tables: 'csv' for the files under
+# DATA_DIR, or 'sqlite' for a single database (see modules/sqlite_backend.py),
+# by default ims.db in DATA_DIR.
+STORAGE_BACKEND = os.environ.get('IMS_STORAGE', 'csv')
+SQLITE_PATH = os.environ.get('IMS_SQLITE_PATH')
+
+# With the CSV backend, log single-row updates and deletes to <file>.wal
+# instead of rewriting the whole file, folding the log back in once it grows
+# past WAL_CHECKPOINT_BYTES.
+CSV_WAL = os.environ.get('IMS_WAL') == '1'
+WAL_CHECKPOINT_BYTES = int(os.environ.get('IMS_WAL_CHECKPOINT_BYTES', 256 * 1024))
+
+# Keep a parsed snapshot next to each CSV of at least SNAPSHOT_MIN_BYTES so
+# loads can skip parsing it (see modules/snapshot.py).
+SNAPSHOTS = os.environ.get('IMS_SNAPSHOTS', '1') == '1'
+SNAPSHOT_MIN_BYTES = int(os.environ.get('IMS_SNAPSHOT_MIN_BYTES', 64 * 1024))
+
+def use_sqlite():
+    return STORAGE_BACKEND == 'sqlite'
+
+def set_data_dir(path):
+    global DATA_DIR
+    DATA_DIR = os.path.abspath(path)
+
+def data_path(filename):
+    return os.path.join(DATA_DIR, filename)
+
+def sqlite_path():
+    return os.path.abspath(SQLITE_PATH) if SQLITE_PATH else data_path('ims.db')
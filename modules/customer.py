@@ -1,92 +1,239 @@
-from modules.file_handler import read_csv, write_csv, add_record, get_next_id, ensure_file_exists
+import re
+from itertools import chain
+from modules.file_handler import get_next_id, iter_input_csv
 from modules.validators import validate_name, validate_phone, validate_id
+from modules.records import Customer
+from modules.stats import instrumented
+from modules.table import Table, SortedIndex, paginate
 
-CUSTOMERS_FILE = 'data/customers.csv'
+CUSTOMERS_FILE = 'customers.csv'
 FIELDNAMES = ['customer_id', 'name', 'phone', 'address']
 
-ensure_file_exists(CUSTOMERS_FILE)
+customers_table = Table(CUSTOMERS_FILE, FIELDNAMES, 'customer_id', Customer, compact=True)
 
-def add_customer(name, phone, address):
+# Search indexes over name, phone and address, built once per reload of
+# customers_table and then kept in step with every add, update and delete it
+# reports. _exact maps each whole value (lower-cased) to customer IDs;
+# _prefixes holds every word of it (the whole number, for phones) in a
+# SortedIndex for prefix matches.
+SEARCH_FIELDS = ('name', 'phone', 'address')
+
+_exact = {field: {} for field in SEARCH_FIELDS}
+_prefixes = {field: SortedIndex() for field in SEARCH_FIELDS}
+_search_generation = None
+
+def _normalize(value):
+    return ' '.join(value.lower().split())
+
+def _tokens(field, value):
+    value = _normalize(value)
+    if field == 'phone':
+        return {value} if value else set()
+    return set(re.findall(r'\w+', value))
+
+def _search_add(customer):
+    for field in SEARCH_FIELDS:
+        value = getattr(customer, field)
+        _exact[field].setdefault(_normalize(value), set()).add(customer.customer_id)
+        for token in _tokens(field, value):
+            _prefixes[field].add(token, customer.customer_id)
+
+def _search_remove(customer):
+    for field in SEARCH_FIELDS:
+        value = getattr(customer, field)
+        ids = _exact[field].get(_normalize(value), set())
+        ids.discard(customer.customer_id)
+        if not ids:
+            _exact[field].pop(_normalize(value), None)
+        for token in _tokens(field, value):
+            _prefixes[field].remove(token, customer.customer_id)
+
+@instrumented
+def rebuild_search_index():
+    global _search_generation
+    customers = customers_table.rows()
+    for field in SEARCH_FIELDS:
+        exact = _exact[field]
+        exact.clear()
+        pairs = []
+        for customer in customers:
+            value = getattr(customer, field)
+            exact.setdefault(_normalize(value), set()).add(customer.customer_id)
+            pairs.extend((token, customer.customer_id) for token in _tokens(field, value))
+        _prefixes[field].build(pairs)
+    _search_generation = customers_table.generation
+
+def _on_customer_change(old, new):
+    if _search_generation != customers_table.generation:
+        return
+    if old is not None:
+        _search_remove(old)
+    if new is not None:
+        _search_add(new)
+
+customers_table.subscribe(_on_customer_change)
+
+def _check_customer(name, phone, address):
     if not validate_name(name):
-        return False, "Invalid name"
+        return "Invalid name"
     if not validate_phone(phone):
-        return False, "Invalid phone number"
+        return "Invalid phone number"
     if not address or len(address) < 2:
-        return False, "Invalid address"
+        return "Invalid address"
+    return ""
+
+@instrumented
+def add_customer(name, phone, address):
+    error = _check_customer(name, phone, address)
+    if error:
+        return False, error
     
-    customer_id = get_next_id(CUSTOMERS_FILE, 'customer_id')
-    record = {
-        'customer_id': customer_id,
-        'name': name,
-        'phone': phone,
-        'address': address
-    }
+    customer_id = get_next_id(customers_table.filepath, 'customer_id')
+    if customer_id is None:
+        return False, "Failed to add customer"
+    record = Customer(customer_id=customer_id, name=name, phone=phone, address=address)
     
-    if add_record(CUSTOMERS_FILE, record, FIELDNAMES):
+    if customers_table.insert(record):
         return True, f"Customer added with ID: {customer_id}"
     return False, "Failed to add customer"
 
-def view_all_customers():
-    customers = read_csv(CUSTOMERS_FILE)
-    if not customers:
+@instrumented
+def import_customers(filepath):
+    # Bulk-adds customers from a CSV with name,phone,address columns. Invalid
+    # rows are skipped and reported as (row_number, message); valid rows get
+    # consecutive IDs and are written in one append.
+    records = []
+    rejected = []
+    
+    for row_number, row in enumerate(iter_input_csv(filepath), start=1):
+        name = (row.get('name') or '').strip()
+        phone = (row.get('phone') or '').strip()
+        address = (row.get('address') or '').strip()
+        
+        error = _check_customer(name, phone, address)
+        if error:
+            rejected.append((row_number, error))
+            continue
+        records.append(Customer(customer_id=None, name=name, phone=phone, address=address))
+    
+    if not records:
+        return 0, rejected
+    
+    first_id = get_next_id(customers_table.filepath, 'customer_id', len(records))
+    if first_id is None:
+        return 0, rejected + [(0, "Failed to add customers")]
+    for offset, record in enumerate(records):
+        record.customer_id = first_id + offset
+    
+    if not customers_table.insert_many(records):
+        return 0, rejected + [(0, "Failed to add customers")]
+    return len(records), rejected
+
+@instrumented
+def view_all_customers(offset=0, limit=None, city=None):
+    # Prints one page of customers streamed from disk; returns True if more
+    # rows follow the page.
+    customers = customers_table.stream()
+    if city:
+        city = city.strip().lower()
+        customers = (c for c in customers if c.address.strip().lower() == city)
+    
+    customers, has_more = paginate(customers, offset, limit)
+    first = next(customers, None)
+    if first is None:
         print("No customers found")
-        return
+        return False
     
     print("\n" + "="*80)
     print(f"{'ID':<5} {'Name':<20} {'Phone':<15} {'Address':<30}")
     print("="*80)
     
-    for customer in customers:
-        print(f"{customer['customer_id']:<5} {customer['name']:<20} {customer['phone']:<15} {customer['address']:<30}")
+    for customer in chain([first], customers):
+        print(f"{customer.customer_id:<5} {customer.name:<20} {customer.phone:<15} {customer.address:<30}")
     print("="*80)
+    return has_more
 
+@instrumented
 def search_customer(customer_id):
     if not validate_id(customer_id):
         return None, "Invalid customer ID"
     
-    customers = read_csv(CUSTOMERS_FILE)
-    for customer in customers:
-        if customer['customer_id'] == str(customer_id):
-            return customer, ""
+    customer = customers_table.get(customer_id)
+    if customer:
+        return customer, ""
     
     return None, "Customer not found"
 
+def _candidates(field, query, exact):
+    # (size, ids) for the cheapest single lookup that every match of this
+    # field must be in.
+    if exact:
+        ids = _exact[field].get(_normalize(query), ())
+        return len(ids), lambda: ids
+    tokens = _tokens(field, query)
+    if not tokens:
+        return 0, lambda: ()
+    token = min(tokens, key=_prefixes[field].count)
+    return _prefixes[field].count(token), lambda: _prefixes[field].prefix(token)
+
+def _matches(customer, field, query, exact):
+    if exact:
+        return _normalize(getattr(customer, field)) == _normalize(query)
+    # Every word of the query has to start some word of the value.
+    words = _tokens(field, getattr(customer, field))
+    return all(any(word.startswith(token) for word in words) for token in _tokens(field, query))
+
+@instrumented
+def find_customers(name=None, phone=None, address=None, exact=False, limit=None):
+    # Customers matching every given field, by ID. By default a field matches
+    # when each word of the query starts a word of the value ("ali kh" finds
+    # "Ali Khan", "0300" finds every 0300 number); exact=True compares whole
+    # values instead. Case and extra spaces are ignored.
+    criteria = [(field, query) for field, query in (('name', name), ('phone', phone), ('address', address))
+                if query and query.strip()]
+    if not criteria:
+        return [], "Enter a name, phone or address to search for"
+    
+    customers_table.refresh()
+    if _search_generation != customers_table.generation:
+        rebuild_search_index()
+    
+    # Start from the narrowest index range and check the rest on the rows,
+    # so a common word ("khan") costs nothing when a rarer one is given.
+    _, candidates = min((_candidates(field, query, exact) for field, query in criteria), key=lambda c: c[0])
+    matches = []
+    for customer_id in sorted(set(candidates())):
+        customer = customers_table.peek(customer_id)
+        if customer and all(_matches(customer, field, query, exact) for field, query in criteria):
+            matches.append(customer)
+            if limit is not None and len(matches) == limit:
+                break
+    
+    if not matches:
+        return [], "No matching customers found"
+    return matches, ""
+
+@instrumented
 def update_customer(customer_id, name=None, phone=None, address=None):
     if not validate_id(customer_id):
         return False, "Invalid customer ID"
     
-    customers = read_csv(CUSTOMERS_FILE)
-    found = False
-    
-    for customer in customers:
-        if customer['customer_id'] == str(customer_id):
-            found = True
-            if name and validate_name(name):
-                customer['name'] = name
-            if phone and validate_phone(phone):
-                customer['phone'] = phone
-            if address and len(address) >= 2:
-                customer['address'] = address
-            break
-    
-    if not found:
+    if not customers_table.get(customer_id):
         return False, "Customer not found"
     
-    if write_csv(CUSTOMERS_FILE, customers, FIELDNAMES):
+    changes = {}
+    if name and validate_name(name):
+        changes['name'] = name
+    if phone and validate_phone(phone):
+        changes['phone'] = phone
+    if address and len(address) >= 2:
+        changes['address'] = address
+    
+    if customers_table.update(customer_id, changes):
         return True, "Customer updated"
     return False, "Failed to update customer"
 
-def delete_customer(customer_id):
-    if not validate_id(customer_id):
-        return False, "Invalid customer ID"
-    
-    customers = read_csv(CUSTOMERS_FILE)
-    initial_count = len(customers)
-    customers = [c for c in customers if c['customer_id'] != str(customer_id)]
-    
-    if len(customers) == initial_count:
-        return False, "Customer not found"
-    
-    if write_csv(CUSTOMERS_FILE, customers, FIELDNAMES):
-        return True, "Customer deleted"
-    return False, "Failed to delete customer"
+@instrumented
+def delete_customer(customer_id, cascade=False):
+    from modules.installment import delete_with_installments
+    return delete_with_installments(customers_table, 'customer_id', customer_id, "Customer", cascade)
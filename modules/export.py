@@ -0,0 +1,219 @@
+import csv
+import json
+import os
+from datetime import date
+from modules.analytics import product_exposure
+from modules.customer import customers_table
+from modules.installment import installments_table
+from modules.payment import payments_table
+from modules.product import products_table
+from modules.records import format_amount, format_date
+from modules.schedule import next_due
+from modules.stats import instrumented
+from modules.table import join
+
+# Reports written to CSV or JSON files as a pipeline of generators:
+# read rows -> join the rows they refer to -> aggregate -> write. Every stage
+# pulls one row at a time from the one before, so an export holds one
+# statement or report row at a time on top of the tables, whatever the size.
+# Joins go through the tables' key and index maps, taken once per export,
+# so statements for every customer are one pass over the customers rather
+# than a get_customer_installments call each.
+#
+# Amounts are written the way the data files hold them ("1500.0"); dates
+# are YYYY-MM-DD.
+
+FORMATS = ('csv', 'json')
+
+# Aging buckets for outstanding balances: (label, most days overdue).
+AGING = (
+    ('Current', 0),
+    ('1-30', 30),
+    ('31-60', 60),
+    ('61-90', 90),
+    ('Over 90', None),
+)
+
+def _aging(days_overdue):
+    for label, upper in AGING:
+        if upper is None or days_overdue <= upper:
+            return label
+
+def _contract(inst, product, today):
+    due = next_due(inst)
+    return {
+        'installment_id': inst.installment_id,
+        'product_id': inst.product_id,
+        'product_name': product.product_name if product else '',
+        'total_price': format_amount(inst.total_price),
+        'paid_amount': format_amount(inst.paid_amount),
+        'remaining_amount': format_amount(inst.remaining_amount),
+        'months': inst.months,
+        'monthly_amount': format_amount(inst.monthly_amount) if inst.has_plan else '',
+        'next_due_date': format_date(due[0]) if due else '',
+        'next_due_amount': format_amount(due[1]) if due else '',
+        'days_overdue': max(0, (today - due[0]).days) if due else 0,
+        'status': "Fully Paid" if inst.fully_paid else "Pending",
+    }
+
+def customer_statements(today=None, include_payments=False, include_empty=False):
+    # One statement per customer, in the order they were added: details, every
+    # contract with its next due installment, totals, and optionally the
+    # payments made on each contract.
+    today = today or date.today()
+    contracts_by_customer = installments_table.index('customer_id')
+    payments_by_installment = payments_table.index('installment_id') if include_payments else None
+    products = products_table.by_key()
+
+    for customer in customers_table.stream():
+        contracts = contracts_by_customer.get(customer.customer_id, [])
+        if not contracts and not include_empty:
+            continue
+
+        lines = []
+        total = paid = outstanding = 0
+        for inst in contracts:
+            line = _contract(inst, products.get(inst.product_id), today)
+            if include_payments:
+                line['payments'] = [
+                    {'payment_id': payment.payment_id, 'date': format_date(payment.timestamp.date()),
+                     'amount': format_amount(payment.amount)}
+                    for payment in payments_by_installment.get(inst.installment_id, [])
+                ]
+            lines.append(line)
+            total += inst.total_price
+            paid += inst.paid_amount
+            outstanding += inst.remaining_amount
+
+        yield {
+            'customer_id': customer.customer_id,
+            'name': customer.name,
+            'phone': customer.phone,
+            'address': customer.address,
+            'statement_date': format_date(today),
+            'contracts': lines,
+            'total': format_amount(total),
+            'paid': format_amount(paid),
+            'outstanding': format_amount(outstanding),
+        }
+
+def statement_lines(statements):
+    # Flattens statements to one row per contract, for CSV.
+    for statement in statements:
+        customer = {name: value for name, value in statement.items() if name != 'contracts'}
+        customer['customer_total'] = customer.pop('total')
+        customer['customer_paid'] = customer.pop('paid')
+        customer['customer_outstanding'] = customer.pop('outstanding')
+        for line in statement['contracts']:
+            line = dict(line)
+            line.pop('payments', None)
+            yield dict(customer, **line)
+
+def outstanding_balances(today=None, min_days_overdue=0):
+    # Every contract with a balance left, with its customer, next due
+    # installment and aging bucket, in installment ID order.
+    today = today or date.today()
+    products = products_table.by_key()
+    pending = (inst for inst in installments_table.stream() if not inst.fully_paid)
+    for inst, customer in join(pending, customers_table, 'customer_id'):
+        line = _contract(inst, products.get(inst.product_id), today)
+        if line['days_overdue'] < min_days_overdue:
+            continue
+        yield {
+            'installment_id': inst.installment_id,
+            'customer_id': inst.customer_id,
+            'name': customer.name if customer else '',
+            'phone': customer.phone if customer else '',
+            'product_name': line['product_name'],
+            'remaining_amount': line['remaining_amount'],
+            'next_due_date': line['next_due_date'],
+            'next_due_amount': line['next_due_amount'],
+            'days_overdue': line['days_overdue'],
+            'aging': _aging(line['days_overdue']) if line['next_due_date'] else "No plan",
+        }
+
+def product_exposure_report():
+    # Per product: contracts, amounts, collection ratio and share of the
+    # book's outstanding balance, largest exposure first.
+    products = products_table.by_key()
+    report = sorted(product_exposure().items(), key=lambda item: -item[1]['outstanding'])
+    for product_id, totals in report:
+        product = products.get(product_id)
+        yield {
+            'product_id': product_id,
+            'product_name': product.product_name if product else '',
+            'contracts': totals['contracts'],
+            'total': format_amount(totals['total']),
+            'paid': format_amount(totals['paid']),
+            'outstanding': format_amount(totals['outstanding']),
+            'collection_ratio': round(totals['collection_ratio'], 4),
+            'exposure': round(totals['exposure'], 4),
+        }
+
+def write_csv_rows(rows, out, fieldnames):
+    # The header is written even when there are no rows. Returns the number
+    # of rows.
+    writer = csv.DictWriter(out, fieldnames=fieldnames)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+def write_json_rows(rows, out):
+    # A JSON array written one element at a time. Returns the number of rows.
+    count = 0
+    out.write("[")
+    for row in rows:
+        out.write(",\n" if count else "\n")
+        out.write(json.dumps(row))
+        count += 1
+    out.write("\n]\n" if count else "]\n")
+    return count
+
+REPORTS = {
+    'statements': customer_statements,
+    'balances': outstanding_balances,
+    'products': product_exposure_report,
+}
+
+# CSV columns of each report; statements are written as statement_lines().
+CSV_FIELDS = {
+    'statements': ['customer_id', 'name', 'phone', 'address', 'statement_date', 'customer_total',
+                   'customer_paid', 'customer_outstanding', 'installment_id', 'product_id', 'product_name',
+                   'total_price', 'paid_amount', 'remaining_amount', 'months', 'monthly_amount',
+                   'next_due_date', 'next_due_amount', 'days_overdue', 'status'],
+    'balances': ['installment_id', 'customer_id', 'name', 'phone', 'product_name', 'remaining_amount',
+                 'next_due_date', 'next_due_amount', 'days_overdue', 'aging'],
+    'products': ['product_id', 'product_name', 'contracts', 'total', 'paid', 'outstanding',
+                 'collection_ratio', 'exposure'],
+}
+
+@instrumented
+def export_report(report, filepath, fmt='csv', **options):
+    # Writes `report` to `filepath`; `options` go to the report's function.
+    # The file is written under a temporary name and renamed when complete.
+    if report not in REPORTS:
+        return False, f"Unknown report: {report}"
+    if fmt not in FORMATS:
+        return False, f"Unknown format: {fmt}"
+
+    rows = REPORTS[report](**options)
+    if report == 'statements' and fmt == 'csv':
+        rows = statement_lines(rows)
+    tmp_path = filepath + '.tmp'
+    try:
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                count = write_csv_rows(rows, f, CSV_FIELDS[report])
+            else:
+                count = write_json_rows(rows, f)
+        os.replace(tmp_path, filepath)
+    except (OSError, csv.Error) as e:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False, f"Failed to write {filepath}: {e}"
+    return True, f"Exported {count} row(s) to {filepath}"
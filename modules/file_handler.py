@@ -1,41 +1,493 @@
 import csv
+import io
+import json
 import os
+import threading
+from contextlib import contextmanager
+from modules import config
+from modules import sqlite_backend
+from modules import stats
 
-def ensure_file_exists(filepath):
+# Appends leave the file in the same shape a full rewrite would, but a crash
+# mid-append can leave a torn last row behind. Files that are also updated and
+# deleted from ask for compaction: every COMPACT_EVERY appends such a file is
+# rewritten once to drop those rows; a normal write_csv resets the count.
+# Append-only files (the payments ledger, the archive) are never compacted.
+COMPACT_EVERY = 500
+
+# Next free ID of every table, kept in a small sidecar next to the data files
+# so inserts never have to parse the table itself.
+SEQUENCES_FILE = 'sequences.csv'
+SEQUENCE_FIELDNAMES = ['table', 'next_id']
+
+_appends_since_compact = {}
+
+# Data files are decoded with surrogateescape: a byte that is not UTF-8 (a
+# hand edit saved in another encoding) is carried through as a lone surrogate
+# and written back as the same byte, so a rewrite keeps it. Rows holding one
+# are not parsed into tables (see undecodable()) and check_integrity reports
+# them.
+ENCODING_ERRORS = 'surrogateescape'
+
+def undecodable(row):
+    # True if a value of `row` holds bytes that were not valid UTF-8.
+    try:
+        text = ''.join(row.values())
+    except TypeError:
+        return False
+    if text.isascii():
+        return False
+    try:
+        text.encode('utf-8')
+    except UnicodeEncodeError:
+        return True
+    return False
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Advisory locks on <file>.lock, held across read-modify-write sequences so
+# several processes sharing one data/ directory cannot interleave writes. The
+# lock is re-entrant within a thread; other threads of the same process wait
+# on a threading lock, since flock does not exclude them. Where fcntl is not
+# available (Windows) only the in-process lock applies.
+_locks = {}
+_locks_guard = threading.Lock()
+
+@contextmanager
+def locked(filepath):
+    with _locks_guard:
+        state = _locks.setdefault(filepath, {'lock': threading.RLock(), 'depth': 0, 'file': None})
+    with state['lock']:
+        if state['depth'] == 0 and fcntl is not None:
+            directory = os.path.dirname(filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            lock_file = open(filepath + '.lock', 'a')
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            state['file'] = lock_file
+        state['depth'] += 1
+        try:
+            yield
+        finally:
+            state['depth'] -= 1
+            if state['depth'] == 0 and state['file'] is not None:
+                fcntl.flock(state['file'].fileno(), fcntl.LOCK_UN)
+                state['file'].close()
+                state['file'] = None
+
+# The lock file also holds the file's rewrite generation: write_csv bumps it
+# on every full rewrite, so file_version() can tell a rewrite (which may reuse
+# the old inode, size and mtime tick) from rows appended to the same file.
+def _read_generation(filepath):
+    try:
+        with open(filepath + '.lock', 'r') as f:
+            return int(f.read() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def _bump_generation(filepath):
+    generation = _read_generation(filepath) + 1
+    with open(filepath + '.lock', 'w') as f:
+        f.write(str(generation))
+
+def _wal_path(filepath):
+    return filepath + '.wal'
+
+def ensure_file_exists(filepath, fieldnames=None):
+    if config.use_sqlite():
+        if fieldnames:
+            sqlite_backend.ensure_table(filepath, fieldnames)
+        return
     if not os.path.exists(filepath):
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         with open(filepath, 'w', newline='') as f:
             f.write("")
 
+def file_version(filepath):
+    if config.use_sqlite():
+        return sqlite_backend.table_version(filepath)
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    generation = _read_generation(filepath)
+    try:
+        wal = os.stat(_wal_path(filepath))
+        return (generation, st.st_mtime_ns, st.st_size, wal.st_mtime_ns, wal.st_size)
+    except OSError:
+        return (generation, st.st_mtime_ns, st.st_size)
+
+# Write-ahead log: one JSON line per updated or deleted row, holding the key
+# column, the key and the full new row (null for a delete). Readers lay the
+# log over the CSV, so it only has to be folded into the file now and then.
+# Torn lines from a crash are skipped.
+def _read_wal(filepath, offset=0):
+    key_column = None
+    overlay = {}
+    try:
+        with open(_wal_path(filepath), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                key_column = entry['key']
+                overlay[entry['id']] = entry['row']
+    except OSError:
+        pass
+    return key_column, overlay
+
+def _apply_wal(rows, key_column, overlay):
+    for row in rows:
+        key = row.get(key_column)
+        if key in overlay:
+            if overlay[key] is None:
+                continue
+            row = dict(overlay[key])
+        yield row
+
+def _append_wal(filepath, key_column, entries):
+    wal_path = _wal_path(filepath)
+    torn = os.path.exists(wal_path) and os.path.getsize(wal_path) > 0 and not _ends_with_newline(wal_path)
+    with open(wal_path, 'a', encoding='utf-8') as f:
+        if torn:
+            f.write("\n")
+        for key, row in entries:
+            f.write(json.dumps({'key': key_column, 'id': key, 'row': row}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+        size = os.fstat(f.fileno()).st_size
+    stats.record_write(wal_path, size)
+    return size
+
+def _truncate_wal(filepath):
+    try:
+        os.remove(_wal_path(filepath))
+    except OSError:
+        pass
+
+def recover_csv(filepath, fieldnames):
+    # Folds a log left behind by an earlier run into the CSV.
+    if config.use_sqlite() or not os.path.exists(_wal_path(filepath)):
+        return True
+    try:
+        data = read_csv(filepath)
+    except (OSError, csv.Error):
+        return False
+    return write_csv(filepath, data, fieldnames)
+
+def upgrade_header(filepath, fieldnames):
+    # Rewrites a CSV whose header predates columns added to `fieldnames`;
+    # existing rows get those columns empty.
+    # The header is read on its own in binary, so this check never depends on
+    # decoding the rest of the file.
+    if config.use_sqlite() or not os.path.exists(filepath):
+        return True
+    try:
+        with open(filepath, 'rb') as f:
+            line = f.readline().decode('utf-8', ENCODING_ERRORS)
+        header = next(csv.reader([line]), None)
+        if not header or not set(fieldnames) - set(header):
+            return True
+        data = read_csv(filepath)
+    except (OSError, csv.Error):
+        return False
+    return write_csv(filepath, data, fieldnames)
+
+def changes_since(filepath, fieldnames, old_version, new_version):
+    # When a CSV has only been appended to, and its log only grown, between
+    # two file_version() results, returns (new_rows, key_column, overlay) for
+    # just the added bytes. Returns None when a full read is needed instead.
+    if config.use_sqlite() or old_version is None or new_version is None:
+        return None
+    if new_version[0] != old_version[0] or old_version[2] == 0 or new_version[2] < old_version[2]:
+        return None
+    old_wal_size = old_version[4] if len(old_version) == 5 else 0
+    new_wal_size = new_version[4] if len(new_version) == 5 else 0
+    if new_wal_size < old_wal_size:
+        return None
+
+    new_rows = []
+    if new_version[2] > old_version[2]:
+        new_rows = read_tail(filepath, fieldnames, old_version[2], new_version[2])
+        if new_rows is None:
+            return None
+
+    key_column, overlay = None, {}
+    if new_wal_size > old_wal_size:
+        key_column, overlay = _read_wal(filepath, old_wal_size)
+    return new_rows, key_column, overlay
+
+def read_tail(filepath, fieldnames, start, end):
+    # Rows in bytes [start, end) of a CSV, where start is the end of an
+    # earlier complete read; None if they cannot be read.
+    try:
+        with open(filepath, 'rb') as f:
+            f.seek(start)
+            tail = f.read(end - start).decode('utf-8', ENCODING_ERRORS)
+    except OSError:
+        return None
+    rows = list(csv.DictReader(io.StringIO(tail, newline=''), fieldnames=fieldnames))
+    stats.record_read(filepath, len(tail), len(rows))
+    return rows
+
 def read_csv(filepath):
+    # Every row of the file; [] if it does not exist. Any other failure
+    # (OSError, csv.Error) is raised, so nothing is ever rewritten from a read
+    # that did not complete.
+    if config.use_sqlite():
+        data = sqlite_backend.read_table(filepath)
+        stats.record_read(filepath, rows=len(data))
+        return data
     try:
-        with open(filepath, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            return list(reader) if reader else []
-    except:
+        f = open(filepath, 'r', newline='', encoding='utf-8', errors=ENCODING_ERRORS)
+    except FileNotFoundError:
         return []
+    with f:
+        data = list(csv.DictReader(f))
+        stats.record_read(filepath, os.fstat(f.fileno()).st_size, len(data))
+    key_column, overlay = _read_wal(filepath)
+    if overlay:
+        data = list(_apply_wal(data, key_column, overlay))
+    return data
+
+def iter_csv(filepath):
+    # Same rows as read_csv, yielded one at a time so callers that only
+    # print or aggregate never hold the whole table.
+    rows = 0
+    nbytes = 0
+    try:
+        if config.use_sqlite():
+            for row in sqlite_backend.iter_table(filepath):
+                rows += 1
+                yield row
+            return
+        key_column, overlay = _read_wal(filepath)
+        with open(filepath, 'r', newline='', encoding='utf-8', errors=ENCODING_ERRORS) as f:
+            nbytes = os.fstat(f.fileno()).st_size
+            for row in _apply_wal(csv.DictReader(f), key_column, overlay):
+                rows += 1
+                yield row
+    except OSError:
+        return
+    finally:
+        stats.record_read(filepath, nbytes, rows)
 
 def write_csv(filepath, data, fieldnames):
+    if config.use_sqlite():
+        try:
+            sqlite_backend.replace_table(filepath, data, fieldnames)
+            stats.record_write(filepath)
+            return True
+        except:
+            return False
+    # Written to a temporary file and renamed over the original, so a crash
+    # leaves either the old file or the new one, never a truncated mix.
+    tmp_path = filepath + '.tmp'
+    with locked(filepath):
+        try:
+            with open(tmp_path, 'w', newline='', encoding='utf-8', errors=ENCODING_ERRORS) as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(data)
+                f.flush()
+                os.fsync(f.fileno())
+                stats.record_write(filepath, os.fstat(f.fileno()).st_size)
+            os.replace(tmp_path, filepath)
+        except (OSError, csv.Error):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        _truncate_wal(filepath)
+        _bump_generation(filepath)
+    _appends_since_compact[filepath] = 0
+    return True
+
+def _ends_with_newline(filepath):
+    with open(filepath, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) in (b'\n', b'\r')
+
+def append_records(filepath, records, fieldnames, sync=False, compact=False):
+    if config.use_sqlite():
+        try:
+            sqlite_backend.insert_rows(filepath, records, fieldnames)
+            stats.record_write(filepath)
+            return True
+        except:
+            return False
     try:
-        with open(filepath, 'w', newline='', encoding='utf-8') as f:
+        size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        needs_newline = size > 0 and not _ends_with_newline(filepath)
+        with open(filepath, 'a', newline='', encoding='utf-8') as f:
+            if needs_newline:
+                f.write('\r\n')
             writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
-        return True
-    except:
+            if size == 0:
+                writer.writeheader()
+            writer.writerows(records)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+            stats.record_write(filepath, os.fstat(f.fileno()).st_size - size)
+    except (OSError, csv.Error):
         return False
 
-def add_record(filepath, record, fieldnames):
-    data = read_csv(filepath)
-    data.append(record)
+    if compact:
+        count = _appends_since_compact.get(filepath, 0) + len(records)
+        _appends_since_compact[filepath] = count
+        if count >= COMPACT_EVERY:
+            compact_csv(filepath, fieldnames)
+    return True
+
+def undo_append(filepath, size, fieldnames, key_column, keys):
+    # Takes back the rows with `keys` that append_records() just added to a
+    # file `size` bytes long: the CSV is cut back to that size, SQLite deletes
+    # them. Only for undoing a step that failed after the append.
+    if config.use_sqlite():
+        return delete_records(filepath, [], fieldnames, key_column, keys)
+    with locked(filepath):
+        try:
+            os.truncate(filepath, size)
+        except OSError:
+            return False
+        _bump_generation(filepath)
+    return True
+
+def append_record(filepath, record, fieldnames, sync=False):
+    return append_records(filepath, [record], fieldnames, sync)
+
+def raw_row(row, fieldnames):
+    # A row as read, in the shape write_csv takes: missing values empty, and
+    # values past the last column (an unquoted comma) joined back onto it.
+    raw = {name: row.get(name) or '' for name in fieldnames}
+    extra = row.get(None)
+    if extra:
+        last = fieldnames[-1]
+        raw[last] = ','.join([raw[last]] + extra)
+    return raw
+
+def compact_csv(filepath, fieldnames):
+    # Rewrites the file without torn rows: those with fewer values than the
+    # header, as an append cut short leaves. Every other row is kept, and
+    # nothing is written if the file cannot be read in full.
+    if config.use_sqlite():
+        return True
+    try:
+        rows = read_csv(filepath)
+    except (OSError, csv.Error):
+        return False
+    data = [raw_row(row, fieldnames) for row in rows if None in row or None not in row.values()]
     return write_csv(filepath, data, fieldnames)
 
-def get_next_id(filepath, id_column):
-    data = read_csv(filepath)
-    if not data:
-        return 1
+def add_record(filepath, record, fieldnames, sync=False):
+    return append_record(filepath, record, fieldnames, sync)
+
+# Single-row changes. `data` is the caller's full table after the change; the
+# CSV backend has to rewrite all of it, the SQLite backend touches one row.
+# With config.CSV_WAL the change is only logged until the log needs folding in.
+def _log_or_write(filepath, data, fieldnames, key_column, entries):
+    if not config.CSV_WAL:
+        return write_csv(filepath, data, fieldnames)
     try:
-        max_id = max(int(record[id_column]) for record in data if record.get(id_column))
-        return max_id + 1
-    except:
-        return 1
+        size = _append_wal(filepath, key_column, entries)
+    except (OSError, TypeError, ValueError):
+        return write_csv(filepath, data, fieldnames)
+    if size >= config.WAL_CHECKPOINT_BYTES:
+        return write_csv(filepath, data, fieldnames)
+    return True
+
+def update_records(filepath, data, fieldnames, key_column, records):
+    if config.use_sqlite():
+        try:
+            stats.record_write(filepath)
+            return sqlite_backend.update_rows(filepath, fieldnames, key_column, records)
+        except:
+            return False
+    entries = [(str(record[key_column]), {name: str(record[name]) for name in fieldnames}) for record in records]
+    return _log_or_write(filepath, data, fieldnames, key_column, entries)
+
+def update_record(filepath, data, fieldnames, key_column, record):
+    return update_records(filepath, data, fieldnames, key_column, [record])
+
+def delete_records(filepath, data, fieldnames, key_column, keys):
+    if config.use_sqlite():
+        try:
+            stats.record_write(filepath)
+            return sqlite_backend.delete_rows(filepath, fieldnames, key_column, keys)
+        except:
+            return False
+    return _log_or_write(filepath, data, fieldnames, key_column, [(str(key), None) for key in keys])
+
+def delete_record(filepath, data, fieldnames, key_column, key):
+    return delete_records(filepath, data, fieldnames, key_column, [key])
+
+def iter_input_csv(filepath):
+    # Rows of a user-supplied CSV (payment or import files), read straight
+    # from disk whichever storage backend is active.
+    rows = 0
+    with open(filepath, 'r', newline='', encoding='utf-8-sig') as f:
+        try:
+            for row in csv.DictReader(f):
+                rows += 1
+                yield row
+        finally:
+            stats.record_read(filepath, os.fstat(f.fileno()).st_size, rows)
+
+def _scan_next_id(filepath, id_column):
+    # Rows whose ID is not a number are skipped rather than restarting at 1.
+    max_id = 0
+    for record in read_csv(filepath):
+        try:
+            max_id = max(max_id, int(record.get(id_column) or ''))
+        except (TypeError, ValueError):
+            continue
+    return max_id + 1
+
+def _sequence_path(filepath):
+    return os.path.join(os.path.dirname(filepath), SEQUENCES_FILE)
+
+def _write_sequences(seq_path, sequences):
+    rows = [{'table': table, 'next_id': next_id} for table, next_id in sorted(sequences.items())]
+    return write_csv(seq_path, rows, SEQUENCE_FIELDNAMES)
+
+def get_next_id(filepath, id_column, count=1):
+    # Reserves `count` consecutive IDs and returns the first of them, or None
+    # if the reservation could not be saved: an ID handed out without being
+    # recorded would be handed out again.
+    if config.use_sqlite():
+        try:
+            return sqlite_backend.next_id(filepath, id_column, count)
+        except:
+            return None
+    with locked(_sequence_path(filepath)):
+        try:
+            return _reserve_ids(filepath, id_column, count)
+        except (OSError, csv.Error):
+            return None
+
+def _reserve_ids(filepath, id_column, count):
+    seq_path = _sequence_path(filepath)
+    table = os.path.basename(filepath)
+    sequences = {}
+    for row in read_csv(seq_path):
+        try:
+            sequences[row['table']] = int(row['next_id'])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    # Tables created before the sequence file existed are seeded by one scan.
+    next_id = sequences.get(table)
+    if next_id is None:
+        next_id = _scan_next_id(filepath, id_column)
+
+    sequences[table] = next_id + count
+    if not _write_sequences(seq_path, sequences):
+        return None
+    return next_id
@@ -1,14 +1,127 @@
-from modules.file_handler import read_csv, write_csv, add_record, get_next_id, ensure_file_exists
-from modules.validators import validate_id, validate_amount
-from modules.customer import search_customer
-from modules.product import search_product
+import os
+from datetime import date, datetime
+from itertools import chain
+from modules import config
+from modules.file_handler import get_next_id, iter_input_csv, append_records, undo_append
+from modules.validators import validate_id, validate_amount, validate_months, validate_date
+from modules.customer import search_customer, customers_table
+from modules.product import search_product, products_table
+from modules.payment import payments_table
+from modules.records import Installment, Payment, parse_amount, format_amount, parse_date, add_months
+from modules.stats import instrumented
+from modules.table import Table, join, paginate
 
-INSTALLMENTS_FILE = 'data/installments.csv'
-FIELDNAMES = ['installment_id', 'customer_id', 'product_id', 'total_price', 'paid_amount', 'remaining_amount']
+INSTALLMENTS_FILE = 'installments.csv'
+# Contracts removed along with their customer or product, same columns.
+ARCHIVE_FILE = 'installments_archive.csv'
+FIELDNAMES = ['installment_id', 'customer_id', 'product_id', 'total_price', 'paid_amount', 'remaining_amount',
+              'months', 'monthly_amount', 'start_date', 'last_payment_id']
 
-ensure_file_exists(INSTALLMENTS_FILE)
+installments_table = Table(INSTALLMENTS_FILE, FIELDNAMES, 'installment_id', Installment,
+                           indexes=('customer_id', 'product_id'), compact=True)
 
-def create_installment(customer_id, product_id, paid_amount):
+# Running totals per customer and for the whole book, kept in step with every
+# row change installments_table reports and rebuilt from the rows whenever the
+# table reloads from disk. Amounts are in paisa, like the rows they sum.
+_customer_totals = {}
+_portfolio_totals = {}
+_totals_generation = None
+
+def _empty_totals():
+    return {'outstanding': 0, 'paid': 0, 'pending': 0, 'fully_paid': 0}
+
+def _apply_totals(inst, sign):
+    status = 'fully_paid' if inst.fully_paid else 'pending'
+    for totals in (_customer_totals.setdefault(inst.customer_id, _empty_totals()), _portfolio_totals):
+        totals['outstanding'] += sign * inst.remaining_amount
+        totals['paid'] += sign * inst.paid_amount
+        totals[status] += sign
+
+@instrumented
+def rebuild_totals():
+    global _totals_generation
+    _customer_totals.clear()
+    _portfolio_totals.clear()
+    _portfolio_totals.update(_empty_totals())
+    for inst in installments_table.rows():
+        _apply_totals(inst, 1)
+    _totals_generation = installments_table.generation
+
+def _current_totals():
+    installments_table.refresh()
+    if _totals_generation != installments_table.generation:
+        rebuild_totals()
+
+def _on_installment_change(old, new):
+    if _totals_generation != installments_table.generation:
+        return
+    if old:
+        _apply_totals(old, -1)
+    if new:
+        _apply_totals(new, 1)
+
+installments_table.subscribe(_on_installment_change)
+
+# Balances come from the payments ledger. A row on disk already includes the
+# payments up to its last_payment_id; newer ones are added when the row is
+# read (_derive_balance) and as they reach payments_table (_sync_ledger), so
+# posting a payment appends to payments.csv and never rewrites this file.
+# Applying a payment twice is a no-op, which is what lets both paths run.
+_pending_payments = []
+_ledger_generation = None
+
+def _ledger_changes(inst, payments):
+    paid = inst.paid_amount
+    last = inst.last_payment_id
+    for payment in payments:
+        if payment.payment_id > last:
+            paid += payment.amount
+            last = payment.payment_id
+    if last == inst.last_payment_id:
+        return None
+    return {
+        'paid_amount': paid,
+        'remaining_amount': inst.remaining_amount - (paid - inst.paid_amount),
+        'last_payment_id': last,
+    }
+
+def _derive_balance(inst):
+    changes = _ledger_changes(inst, payments_table.peek_lookup('installment_id', inst.installment_id))
+    for name, value in (changes or {}).items():
+        setattr(inst, name, value)
+
+def _apply_payment(payment):
+    inst = installments_table.peek(payment.installment_id)
+    if inst is None:
+        return
+    changes = _ledger_changes(inst, [payment])
+    if changes:
+        installments_table.patch(inst, changes)
+
+def _sync_ledger():
+    global _ledger_generation
+    payments_table.refresh()
+    if _ledger_generation != payments_table.generation:
+        _ledger_generation = payments_table.generation
+        _pending_payments.clear()
+        for payment in payments_table.rows():
+            _apply_payment(payment)
+    while _pending_payments:
+        _apply_payment(_pending_payments.pop(0))
+
+def _on_payment(old, new):
+    if old is None and new is not None:
+        _pending_payments.append(new)
+
+installments_table.derive = _derive_balance
+installments_table.on_refresh(_sync_ledger)
+payments_table.subscribe(_on_payment)
+
+@instrumented
+def create_installment(customer_id, product_id, paid_amount, months=None, start_date=None):
+    # With `months`, the balance after the down payment is split into that
+    # many monthly installments, the first due on `start_date` (default: one
+    # month from today). See modules/schedule.py.
     if not validate_id(customer_id):
         return False, "Invalid customer ID"
     if not validate_id(product_id):
@@ -22,52 +135,97 @@ def create_installment(customer_id, product_id, paid_amount):
     if not product:
         return False, "Product not found"
     
-    total_price = float(product['price'])
+    total_price = product.price
     
     if not validate_amount(paid_amount):
         return False, "Invalid paid amount"
     
-    paid_amt = float(paid_amount)
+    paid_amt = parse_amount(paid_amount)
     if paid_amt > total_price:
         return False, "Paid amount exceeds total price"
     
     remaining = total_price - paid_amt
-    installment_id = get_next_id(INSTALLMENTS_FILE, 'installment_id')
-    
-    record = {
-        'installment_id': installment_id,
-        'customer_id': str(customer_id),
-        'product_id': str(product_id),
-        'total_price': str(total_price),
-        'paid_amount': str(paid_amt),
-        'remaining_amount': str(remaining)
-    }
     
-    if add_record(INSTALLMENTS_FILE, record, FIELDNAMES):
-        return True, f"Installment created with ID: {installment_id}"
+    monthly_amount = 0
+    first_due = None
+    if months:
+        if not validate_months(months):
+            return False, "Invalid number of months"
+        if start_date and not validate_date(start_date):
+            return False, "Invalid start date"
+        if remaining == 0:
+            months = 0
+        else:
+            months = int(months)
+            monthly_amount = -(-remaining // months)
+            first_due = parse_date(start_date) if start_date else add_months(date.today(), 1)
+    else:
+        months = 0
+    
+    installment_id = get_next_id(installments_table.filepath, 'installment_id')
+    if installment_id is None:
+        return False, "Failed to create installment"
+    
+    record = Installment(
+        installment_id=installment_id,
+        customer_id=customer.customer_id,
+        product_id=product.product_id,
+        total_price=total_price,
+        paid_amount=paid_amt,
+        remaining_amount=remaining,
+        months=months,
+        monthly_amount=monthly_amount,
+        start_date=first_due,
+        last_payment_id=0
+    )
+    
+    with installments_table.transaction():
+        # Checked again under the lock delete_customer and delete_product
+        # hold, so no contract is added for a row they are removing.
+        if customers_table.get(customer.customer_id) is None:
+            return False, "Customer not found"
+        if products_table.get(product.product_id) is None:
+            return False, "Product not found"
+        if installments_table.insert(record):
+            return True, f"Installment created with ID: {installment_id}"
     return False, "Failed to create installment"
 
-def view_all_installments():
-    installments = read_csv(INSTALLMENTS_FILE)
-    if not installments:
+@instrumented
+def view_all_installments(offset=0, limit=None, pending_only=False, customer_id=None):
+    # Prints one page of installments streamed from disk; returns True if
+    # more rows follow the page.
+    if customer_id is not None and not validate_id(customer_id):
+        print("Invalid customer ID")
+        return False
+    
+    installments = installments_table.stream()
+    if pending_only:
+        installments = (i for i in installments if not i.fully_paid)
+    if customer_id is not None:
+        customer_id = int(customer_id)
+        installments = (i for i in installments if i.customer_id == customer_id)
+    
+    installments, has_more = paginate(installments, offset, limit)
+    first = next(installments, None)
+    if first is None:
         print("No installments found")
-        return
+        return False
     
     print("\n" + "="*130)
     print(f"{'ID':<5} {'Cust':<5} {'Prod':<5} {'Total':<12} {'Paid':<12} {'Remaining':<12} {'Status':<15} {'Customer':<20}")
     print("="*130)
     
-    for inst in installments:
-        customer, _ = search_customer(inst['customer_id'])
-        remaining = float(inst['remaining_amount'])
-        status = "Fully Paid" if remaining == 0 else "Pending"
-        customer_name = customer['name'] if customer else "Unknown"
+    for inst, customer in join(chain([first], installments), customers_table, 'customer_id'):
+        status = "Fully Paid" if inst.fully_paid else "Pending"
+        customer_name = customer.name if customer else "Unknown"
         
-        print(f"{inst['installment_id']:<5} {inst['customer_id']:<5} {inst['product_id']:<5} "
-              f"{inst['total_price']:<12} {inst['paid_amount']:<12} {inst['remaining_amount']:<12} "
-              f"{status:<15} {customer_name:<20}")
+        print(f"{inst.installment_id:<5} {inst.customer_id:<5} {inst.product_id:<5} "
+              f"{format_amount(inst.total_price):<12} {format_amount(inst.paid_amount):<12} "
+              f"{format_amount(inst.remaining_amount):<12} {status:<15} {customer_name:<20}")
     print("="*130)
+    return has_more
 
+@instrumented
 def search_installment(installment_id):
     try:
         inst_id = int(installment_id)
@@ -76,60 +234,218 @@ def search_installment(installment_id):
     except:
         return None, "Invalid installment ID"
     
-    installments = read_csv(INSTALLMENTS_FILE)
-    for inst in installments:
-        if inst['installment_id'] == str(installment_id):
-            return inst, ""
+    inst = installments_table.get(installment_id)
+    if inst:
+        return inst, ""
     
     return None, "Installment not found"
 
+@instrumented
 def make_payment(installment_id, payment_amount):
-    if not validate_amount(payment_amount):
-        return False, "Invalid payment amount"
+    # The balance check, the payment ID and the ledger append all happen under
+    # the installments lock. Split up, two processes could both pass the check,
+    # or a payment could land after a higher payment ID its installment
+    # already counts (last_payment_id) and be skipped. Payments from several
+    # processes are therefore posted one at a time, and each process also
+    # reads back what the others appended, so more processes do not post
+    # payments faster (see benchmark.py --stress); post_payments is the way to
+    # post many at once.
+    with installments_table.transaction():
+        if not validate_amount(payment_amount):
+            return False, "Invalid payment amount"
+        
+        installment, msg = search_installment(installment_id)
+        if not installment:
+            return False, msg
+        
+        current_remaining = installment.remaining_amount
+        payment_amt = parse_amount(payment_amount)
+        
+        if payment_amt > current_remaining:
+            return False, f"Payment exceeds remaining balance ({format_amount(current_remaining)})"
+        
+        new_remaining = current_remaining - payment_amt
+        payment_id = get_next_id(payments_table.filepath, 'payment_id')
+        if payment_id is None:
+            return False, "Failed to process payment"
+        payment = Payment(
+            payment_id=payment_id,
+            installment_id=installment.installment_id,
+            amount=payment_amt,
+            timestamp=datetime.now().replace(microsecond=0)
+        )
+        
+        if payments_table.insert(payment):
+            _sync_ledger()
+            status = "FULLY PAID" if new_remaining == 0 else f"Remaining: {format_amount(new_remaining)}"
+            return True, f"Payment successful. {status}"
+        return False, "Failed to process payment"
+
+@instrumented
+def post_payments(payments):
+    # Posts (installment_id, amount) pairs against the loaded table with one
+    # append to the ledger. Returns the number posted and a list of
+    # (row_number, installment_id, message) for every rejected row.
+    with installments_table.transaction():
+        failures = []
+        accepted = []
+        balances = {}
+        
+        for row_number, (installment_id, payment_amount) in enumerate(payments, start=1):
+            if not validate_amount(payment_amount):
+                failures.append((row_number, installment_id, "Invalid payment amount"))
+                continue
+        
+            installment, msg = search_installment(installment_id)
+            if not installment:
+                failures.append((row_number, installment_id, msg))
+                continue
+        
+            key = installment.installment_id
+            paid, remaining = balances.get(key, (installment.paid_amount, installment.remaining_amount))
+            payment_amt = parse_amount(payment_amount)
+        
+            if payment_amt > remaining:
+                failures.append((row_number, installment_id,
+                                 f"Payment exceeds remaining balance ({format_amount(remaining)})"))
+                continue
+        
+            balances[key] = (paid + payment_amt, remaining - payment_amt)
+            accepted.append((row_number, installment_id, key, payment_amt))
+        
+        if not accepted:
+            return 0, failures
+        
+        first_id = get_next_id(payments_table.filepath, 'payment_id', len(accepted))
+        if first_id is None:
+            failures.extend((row_number, installment_id, "Failed to process payment")
+                            for row_number, installment_id, _, _ in accepted)
+            failures.sort()
+            return 0, failures
+        timestamp = datetime.now().replace(microsecond=0)
+        records = [
+            Payment(payment_id=first_id + n, installment_id=key, amount=amount, timestamp=timestamp)
+            for n, (_, _, key, amount) in enumerate(accepted)
+        ]
+        
+        if not payments_table.insert_many(records):
+            failures.extend((row_number, installment_id, "Failed to process payment")
+                            for row_number, installment_id, _, _ in accepted)
+            failures.sort()
+            return 0, failures
+        _sync_ledger()
+        return len(accepted), failures
+
+@instrumented
+def archive_installments(installments):
+    # Moves contracts to ARCHIVE_FILE and out of installments. Their payments
+    # stay in the ledger. On failure neither file is left changed.
+    return _archive(installments) is not None
+
+def _archive(installments):
+    # archive_installments(), returning the size ARCHIVE_FILE had before, for
+    # _unarchive(), or None on failure.
+    with installments_table.transaction():
+        archive = config.data_path(ARCHIVE_FILE)
+        size = os.path.getsize(archive) if os.path.exists(archive) else 0
+        if (append_records(archive, [inst.to_row() for inst in installments], FIELDNAMES) and
+                installments_table.delete_many([inst.installment_id for inst in installments])):
+            return size
+        _unarchive(installments, size)
+        return None
+
+def _unarchive(installments, size):
+    return undo_append(config.data_path(ARCHIVE_FILE), size, FIELDNAMES, 'installment_id',
+                       [inst.installment_id for inst in installments])
+
+def delete_with_installments(table, column, key, noun, cascade=False):
+    # delete_customer and delete_product: deletes `key` from `table`, refusing
+    # while installments refer to it through `column` unless `cascade` is set,
+    # in which case those are archived first and put back if the delete then
+    # fails. customer.py and product.py import this inside those functions,
+    # since this module imports theirs.
+    if not validate_id(key):
+        return False, f"Invalid {noun.lower()} ID"
     
-    installment, msg = search_installment(installment_id)
-    if not installment:
-        return False, msg
+    with installments_table.transaction():
+        if not table.get(key):
+            return False, f"{noun} not found"
+        
+        contracts = list(installments_table.lookup(column, key))
+        if contracts and not cascade:
+            return False, f"{noun} has {len(contracts)} installment(s); archive them to delete"
+        size = _archive(contracts) if contracts else None
+        if contracts and size is None:
+            return False, "Failed to archive installments"
+        
+        if table.delete(key):
+            if contracts:
+                return True, f"{noun} deleted, {len(contracts)} installment(s) archived"
+            return True, f"{noun} deleted"
+        if contracts and not (installments_table.reinsert(contracts) and _unarchive(contracts, size)):
+            return False, f"Failed to delete {noun.lower()}; its installments could not be restored from the archive"
+    return False, f"Failed to delete {noun.lower()}"
+
+def load_payment_file(filepath):
+    for row in iter_input_csv(filepath):
+        yield row.get('installment_id', ''), row.get('amount', '')
+
+@instrumented
+def get_customer_installments(customer_id):
+    if not validate_id(customer_id):
+        return [], "Invalid customer ID"
     
-    current_remaining = float(installment['remaining_amount'])
-    payment_amt = float(payment_amount)
+    customer, msg = search_customer(customer_id)
+    if not customer:
+        return [], "Customer not found"
     
-    if payment_amt > current_remaining:
-        return False, f"Payment exceeds remaining balance ({current_remaining})"
+    return list(installments_table.lookup('customer_id', customer_id)), ""
+
+@instrumented
+def get_payment_history(installment_id):
+    # Payments made against one installment, oldest first.
+    installment, msg = search_installment(installment_id)
+    if not installment:
+        return [], msg
     
-    new_paid = float(installment['paid_amount']) + payment_amt
-    new_remaining = current_remaining - payment_amt
+    return list(payments_table.lookup('installment_id', installment.installment_id)), ""
+
+@instrumented
+def get_product_installments(product_id):
+    if not validate_id(product_id):
+        return [], "Invalid product ID"
     
-    installments = read_csv(INSTALLMENTS_FILE)
-    for inst in installments:
-        if inst['installment_id'] == str(installment_id):
-            inst['paid_amount'] = str(new_paid)
-            inst['remaining_amount'] = str(new_remaining)
-            break
+    product, msg = search_product(product_id)
+    if not product:
+        return [], "Product not found"
     
-    if write_csv(INSTALLMENTS_FILE, installments, FIELDNAMES):
-        status = "FULLY PAID" if new_remaining == 0 else f"Remaining: {new_remaining}"
-        return True, f"Payment successful. {status}"
-    return False, "Failed to process payment"
+    return list(installments_table.lookup('product_id', product_id)), ""
 
-def get_customer_installments(customer_id):
+@instrumented
+def get_customer_totals(customer_id):
     if not validate_id(customer_id):
-        return [], "Invalid customer ID"
+        return None, "Invalid customer ID"
     
     customer, msg = search_customer(customer_id)
     if not customer:
-        return [], "Customer not found"
+        return None, "Customer not found"
     
-    installments = read_csv(INSTALLMENTS_FILE)
-    customer_installments = [i for i in installments if i['customer_id'] == str(customer_id)]
-    
-    return customer_installments, ""
+    _current_totals()
+    totals = _customer_totals.get(customer.customer_id)
+    if not totals or totals['pending'] + totals['fully_paid'] == 0:
+        return None, "No installments found for this customer"
+    return dict(totals), ""
 
+@instrumented
 def get_customer_total_balance(customer_id):
-    installments, msg = get_customer_installments(customer_id)
+    totals, msg = get_customer_totals(customer_id)
     
-    if not installments:
+    if not totals:
         return 0, "No installments found for this customer"
     
-    total_balance = sum(float(i['remaining_amount']) for i in installments)
-    return total_balance, ""
+    return totals['outstanding'], ""
+
+@instrumented
+def get_portfolio_totals():
+    _current_totals()
+    return dict(_portfolio_totals)
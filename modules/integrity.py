@@ -0,0 +1,75 @@
+from modules import config
+from modules.customer import CUSTOMERS_FILE
+from modules.file_handler import iter_csv, undecodable
+from modules.installment import INSTALLMENTS_FILE, ARCHIVE_FILE
+from modules.payment import PAYMENTS_FILE
+from modules.product import PRODUCTS_FILE
+from modules.records import Customer, Product, Installment, Payment
+from modules.stats import instrumented
+
+# One-shot consistency check of the data files. Each file is streamed once,
+# in dependency order, keeping only the sets of IDs later files refer to, so
+# it runs in a single pass without loading any table into memory.
+
+def _rows(filename, record):
+    # (row_number, record or None) for every row; None when it cannot be parsed.
+    for row_number, row in enumerate(iter_csv(config.data_path(filename)), start=1):
+        if None in row or undecodable(row):
+            yield row_number, None
+            continue
+        try:
+            yield row_number, record.from_row(row)
+        except (KeyError, TypeError, ValueError):
+            yield row_number, None
+
+def _check_ids(filename, record, key, problems, check=None):
+    ids = set()
+    for row_number, row in _rows(filename, record):
+        if row is None:
+            problems.append((filename, row_number, "Unreadable row"))
+            continue
+        row_id = getattr(row, key)
+        if row_id in ids:
+            problems.append((filename, row_number, f"Duplicate {key} {row_id}"))
+        ids.add(row_id)
+        if check:
+            for message in check(row):
+                problems.append((filename, row_number, message))
+    return ids
+
+@instrumented
+def check_integrity():
+    # Returns a list of (file, row_number, message); empty when all is well.
+    problems = []
+
+    customer_ids = _check_ids(CUSTOMERS_FILE, Customer, 'customer_id', problems)
+
+    def check_product(product):
+        if product.price <= 0:
+            yield "Price is not positive"
+
+    product_ids = _check_ids(PRODUCTS_FILE, Product, 'product_id', problems, check_product)
+
+    def check_installment(inst):
+        if inst.customer_id not in customer_ids:
+            yield f"Customer {inst.customer_id} does not exist"
+        if inst.product_id not in product_ids:
+            yield f"Product {inst.product_id} does not exist"
+        if inst.paid_amount < 0 or inst.remaining_amount < 0:
+            yield "Negative amount"
+        if inst.paid_amount + inst.remaining_amount != inst.total_price:
+            yield "Paid and remaining amounts do not add up to the total price"
+        if inst.months and not inst.has_plan:
+            yield "Incomplete payment plan"
+
+    installment_ids = _check_ids(INSTALLMENTS_FILE, Installment, 'installment_id', problems, check_installment)
+    installment_ids |= {inst.installment_id for _, inst in _rows(ARCHIVE_FILE, Installment) if inst}
+
+    def check_payment(payment):
+        if payment.installment_id not in installment_ids:
+            yield f"Installment {payment.installment_id} does not exist"
+        if payment.amount <= 0:
+            yield "Amount is not positive"
+
+    _check_ids(PAYMENTS_FILE, Payment, 'payment_id', problems, check_payment)
+    return problems
@@ -0,0 +1,11 @@
+from modules.records import Payment
+from modules.table import Table
+
+# The payments ledger: one row per payment, only ever appended to. Installment
+# balances are derived from it (see modules/installment.py), so posting a
+# payment is a single append rather than a rewrite of installments.csv.
+
+PAYMENTS_FILE = 'payments.csv'
+FIELDNAMES = ['payment_id', 'installment_id', 'amount', 'timestamp']
+
+payments_table = Table(PAYMENTS_FILE, FIELDNAMES, 'payment_id', Payment, indexes=('installment_id',))
@@ -1,87 +1,122 @@
-from modules.file_handler import read_csv, write_csv, add_record, get_next_id, ensure_file_exists
+from itertools import chain
+from modules.file_handler import get_next_id, iter_input_csv
 from modules.validators import validate_price, validate_id, validate_name
+from modules.records import Product, parse_amount, format_amount
+from modules.stats import instrumented
+from modules.table import Table, paginate
 
-PRODUCTS_FILE = 'data/products.csv'
+PRODUCTS_FILE = 'products.csv'
 FIELDNAMES = ['product_id', 'product_name', 'price']
 
-ensure_file_exists(PRODUCTS_FILE)
+products_table = Table(PRODUCTS_FILE, FIELDNAMES, 'product_id', Product, compact=True)
 
-def add_product(product_name, price):
+def _check_product(product_name, price):
     if not validate_name(product_name):
-        return False, "Invalid product name"
+        return "Invalid product name"
     if not validate_price(price):
-        return False, "Invalid price"
+        return "Invalid price"
+    return ""
+
+@instrumented
+def add_product(product_name, price):
+    error = _check_product(product_name, price)
+    if error:
+        return False, error
     
-    product_id = get_next_id(PRODUCTS_FILE, 'product_id')
-    record = {
-        'product_id': product_id,
-        'product_name': product_name,
-        'price': str(price)
-    }
+    product_id = get_next_id(products_table.filepath, 'product_id')
+    if product_id is None:
+        return False, "Failed to add product"
+    record = Product(product_id=product_id, product_name=product_name, price=parse_amount(price))
     
-    if add_record(PRODUCTS_FILE, record, FIELDNAMES):
+    if products_table.insert(record):
         return True, f"Product added with ID: {product_id}"
     return False, "Failed to add product"
 
-def view_all_products():
-    products = read_csv(PRODUCTS_FILE)
-    if not products:
+@instrumented
+def import_products(filepath):
+    # Bulk-adds products from a CSV with product_name,price columns. Invalid
+    # rows are skipped and reported as (row_number, message); valid rows get
+    # consecutive IDs and are written in one append.
+    records = []
+    rejected = []
+    
+    for row_number, row in enumerate(iter_input_csv(filepath), start=1):
+        product_name = (row.get('product_name') or '').strip()
+        price = (row.get('price') or '').strip()
+        
+        error = _check_product(product_name, price)
+        if error:
+            rejected.append((row_number, error))
+            continue
+        records.append(Product(product_id=None, product_name=product_name, price=parse_amount(price)))
+    
+    if not records:
+        return 0, rejected
+    
+    first_id = get_next_id(products_table.filepath, 'product_id', len(records))
+    if first_id is None:
+        return 0, rejected + [(0, "Failed to add products")]
+    for offset, record in enumerate(records):
+        record.product_id = first_id + offset
+    
+    if not products_table.insert_many(records):
+        return 0, rejected + [(0, "Failed to add products")]
+    return len(records), rejected
+
+@instrumented
+def view_all_products(offset=0, limit=None, name=None):
+    # Prints one page of products streamed from disk; returns True if more
+    # rows follow the page.
+    products = products_table.stream()
+    if name:
+        name = name.strip().lower()
+        products = (p for p in products if name in p.product_name.lower())
+    
+    products, has_more = paginate(products, offset, limit)
+    first = next(products, None)
+    if first is None:
         print("No products found")
-        return
+        return False
     
     print("\n" + "="*60)
     print(f"{'ID':<10} {'Product Name':<25} {'Price':<15}")
     print("="*60)
     
-    for product in products:
-        print(f"{product['product_id']:<10} {product['product_name']:<25} {product['price']:<15}")
+    for product in chain([first], products):
+        print(f"{product.product_id:<10} {product.product_name:<25} {format_amount(product.price):<15}")
     print("="*60)
+    return has_more
 
+@instrumented
 def search_product(product_id):
     if not validate_id(product_id):
         return None, "Invalid product ID"
     
-    products = read_csv(PRODUCTS_FILE)
-    for product in products:
-        if product['product_id'] == str(product_id):
-            return product, ""
+    product = products_table.get(product_id)
+    if product:
+        return product, ""
     
     return None, "Product not found"
 
+@instrumented
 def update_product(product_id, product_name=None, price=None):
     if not validate_id(product_id):
         return False, "Invalid product ID"
     
-    products = read_csv(PRODUCTS_FILE)
-    found = False
-    
-    for product in products:
-        if product['product_id'] == str(product_id):
-            found = True
-            if product_name and validate_name(product_name):
-                product['product_name'] = product_name
-            if price and validate_price(price):
-                product['price'] = str(price)
-            break
-    
-    if not found:
+    if not products_table.get(product_id):
         return False, "Product not found"
     
-    if write_csv(PRODUCTS_FILE, products, FIELDNAMES):
+    changes = {}
+    if product_name and validate_name(product_name):
+        changes['product_name'] = product_name
+    if price and validate_price(price):
+        changes['price'] = parse_amount(price)
+    
+    if products_table.update(product_id, changes):
         return True, "Product updated"
     return False, "Failed to update product"
 
-def delete_product(product_id):
-    if not validate_id(product_id):
-        return False, "Invalid product ID"
-    
-    products = read_csv(PRODUCTS_FILE)
-    initial_count = len(products)
-    products = [p for p in products if p['product_id'] != str(product_id)]
-    
-    if len(products) == initial_count:
-        return False, "Product not found"
-    
-    if write_csv(PRODUCTS_FILE, products, FIELDNAMES):
-        return True, "Product deleted"
-    return False, "Failed to delete product"
+@instrumented
+def delete_product(product_id, cascade=False):
+    from modules.installment import delete_with_installments
+    return delete_with_installments(products_table, 'product_id', product_id, "Product", cascade)
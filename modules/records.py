@@ -0,0 +1,158 @@
+from calendar import monthrange
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Typed rows for the tables Table keeps in memory. Each row is parsed from its
+# CSV strings once, when it is loaded, and turned back into the same strings
+# only when it is written. IDs are ints and money is an int count of paisa
+# (1/100 of a rupee), so totals add up exactly and nothing is re-parsed on
+# every access. __slots__ keeps a row to one small object instead of a dict.
+
+def parse_amount(text):
+    # "1500", "1500.0" and "1500.5" -> 150000, 150000 and 150050 paisa.
+    # Raises ValueError for anything that is not a finite number.
+    try:
+        value = Decimal(str(text).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {text!r}")
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {text!r}")
+    return int((value * 100).to_integral_value(ROUND_HALF_UP))
+
+def format_amount(units):
+    # Inverse of parse_amount, written the way the files have always held
+    # amounts: 150000 -> "1500.0", 150050 -> "1500.5", 150025 -> "1500.25".
+    sign = '-' if units < 0 else ''
+    whole, cents = divmod(abs(units), 100)
+    if cents % 10 == 0:
+        return f"{sign}{whole}.{cents // 10}"
+    return f"{sign}{whole}.{cents:02d}"
+
+def parse_date(text):
+    # "2025-03-01" -> date(2025, 3, 1); blank -> None.
+    text = str(text or '').strip()
+    return date.fromisoformat(text) if text else None
+
+def format_date(value):
+    return value.isoformat() if value else ''
+
+def parse_timestamp(text):
+    return datetime.fromisoformat(str(text).strip())
+
+def format_timestamp(value):
+    return value.isoformat(timespec='seconds')
+
+def add_months(day, months):
+    # Same day `months` later, clamped to the end of shorter months.
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    month += 1
+    return day.replace(year=year, month=month, day=min(day.day, monthrange(year, month)[1]))
+
+# Columns added after the first release are blank in older rows: these read
+# blank as 0 and write 0 back as blank.
+def _parse_count(text):
+    text = str(text or '').strip()
+    return int(text) if text else 0
+
+def _parse_optional_amount(text):
+    return parse_amount(text) if str(text or '').strip() else 0
+
+def _format_count(value):
+    return str(value) if value else ''
+
+def _format_optional_amount(units):
+    return format_amount(units) if units else ''
+
+def _compile_builder(cls):
+    # A function that makes a row from a tuple of typed values in FIELDS
+    # order with one unpacking assignment, a few times faster than setattr()
+    # per field when millions of rows are rebuilt from a snapshot.
+    targets = ", ".join(f"row.{name}" for name in cls.FIELDS)
+    namespace = {'new': cls.__new__, 'cls': cls}
+    exec(f"def build(values):\n    row = new(cls)\n    {targets} = values\n    return row\n", namespace)
+    return namespace['build']
+
+_builders = {}
+
+ID = (int, str)
+TEXT = (str, str)
+AMOUNT = (parse_amount, format_amount)
+COUNT = (_parse_count, _format_count)
+OPTIONAL_AMOUNT = (_parse_optional_amount, _format_optional_amount)
+DATE = (parse_date, format_date)
+TIMESTAMP = (parse_timestamp, format_timestamp)
+
+class Record:
+    # FIELDS maps every CSV column, in file order, to a (parse, format) pair.
+    __slots__ = ()
+    FIELDS = {}
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            setattr(self, name, values[name])
+
+    @classmethod
+    def from_row(cls, row):
+        record = cls.__new__(cls)
+        for name, (parse, _) in cls.FIELDS.items():
+            setattr(record, name, parse(row.get(name)))
+        return record
+
+    @classmethod
+    def from_values(cls, columns):
+        # Rows from one sequence of typed values per field, in FIELDS order.
+        build = _builders.get(cls)
+        if build is None:
+            build = _builders[cls] = _compile_builder(cls)
+        return list(map(build, zip(*columns)))
+
+    @classmethod
+    def parse(cls, column, value):
+        return cls.FIELDS[column][0](value)
+
+    def to_row(self):
+        return {name: fmt(getattr(self, name)) for name, (_, fmt) in self.FIELDS.items()}
+
+    def copy(self):
+        record = self.__class__.__new__(self.__class__)
+        record.assign(self)
+        return record
+
+    def assign(self, other):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(other, name))
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{self.__class__.__name__}({values})"
+
+class Customer(Record):
+    FIELDS = {'customer_id': ID, 'name': TEXT, 'phone': TEXT, 'address': TEXT}
+    __slots__ = tuple(FIELDS)
+
+class Product(Record):
+    FIELDS = {'product_id': ID, 'product_name': TEXT, 'price': AMOUNT}
+    __slots__ = tuple(FIELDS)
+
+class Installment(Record):
+    # months, monthly_amount and start_date (the first due date) describe the
+    # payment plan; contracts without one have months == 0. last_payment_id
+    # is the newest payment in the ledger that paid_amount already includes.
+    FIELDS = {'installment_id': ID, 'customer_id': ID, 'product_id': ID,
+              'total_price': AMOUNT, 'paid_amount': AMOUNT, 'remaining_amount': AMOUNT,
+              'months': COUNT, 'monthly_amount': OPTIONAL_AMOUNT, 'start_date': DATE,
+              'last_payment_id': COUNT}
+    __slots__ = tuple(FIELDS)
+
+    @property
+    def fully_paid(self):
+        return self.remaining_amount == 0
+
+    @property
+    def has_plan(self):
+        return self.months > 0 and self.monthly_amount > 0 and self.start_date is not None
+
+class Payment(Record):
+    FIELDS = {'payment_id': ID, 'installment_id': ID, 'amount': AMOUNT, 'timestamp': TIMESTAMP}
+    __slots__ = tuple(FIELDS)
@@ -0,0 +1,113 @@
+from bisect import bisect_left, insort
+from datetime import date, timedelta
+from modules.installment import installments_table
+from modules.records import add_months
+from modules.stats import instrumented
+
+# Payment schedules for installments with a plan, and a date-ordered index of
+# every contract's next unpaid due date. The index is a sorted list of
+# (due_date, installment_id) built from installments_table once per reload and
+# then kept current from its change notifications, so "overdue" and "due soon"
+# are two bisects instead of a pass over every contract.
+#
+# A plan spreads the balance left after the down payment over `months` equal
+# installments of `monthly_amount`, the first due on `start_date` and the rest
+# on the same day of the following months. Payments settle the earliest
+# installments first.
+
+_due = []
+_next_due = {}
+_generation = None
+
+def _due_by(inst, number):
+    # Total that should have been paid once installment `number` is due;
+    # number 0 is the down payment.
+    return max(0, inst.total_price - (inst.months - number) * inst.monthly_amount)
+
+def payment_schedule(inst):
+    # [(number, due_date, amount, amount_still_owed)] for every installment
+    # of the plan; empty when the contract has none.
+    if not inst.has_plan:
+        return []
+    schedule = []
+    for number in range(1, inst.months + 1):
+        due = _due_by(inst, number)
+        amount = due - _due_by(inst, number - 1)
+        owed = min(amount, max(0, due - inst.paid_amount))
+        schedule.append((number, add_months(inst.start_date, number - 1), amount, owed))
+    return schedule
+
+def next_due(inst):
+    # (due_date, amount owed on it) for the earliest installment not yet
+    # fully paid, or None when nothing more is due.
+    if not inst.has_plan or inst.fully_paid:
+        return None
+    unpaid = -(-inst.remaining_amount // inst.monthly_amount)
+    number = max(1, inst.months - unpaid + 1)
+    return add_months(inst.start_date, number - 1), _due_by(inst, number) - inst.paid_amount
+
+def _index_add(inst):
+    due = next_due(inst)
+    if due is not None:
+        entry = (due[0], inst.installment_id)
+        insort(_due, entry)
+        _next_due[inst.installment_id] = entry
+
+def _index_remove(inst):
+    entry = _next_due.pop(inst.installment_id, None)
+    if entry is not None:
+        n = bisect_left(_due, entry)
+        if n < len(_due) and _due[n] == entry:
+            del _due[n]
+
+@instrumented
+def rebuild_due_index():
+    global _generation
+    _next_due.clear()
+    for inst in installments_table.rows():
+        due = next_due(inst)
+        if due is not None:
+            _next_due[inst.installment_id] = (due[0], inst.installment_id)
+    _due[:] = sorted(_next_due.values())
+    _generation = installments_table.generation
+
+def _current():
+    installments_table.refresh()
+    if _generation != installments_table.generation:
+        rebuild_due_index()
+
+def _on_installment_change(old, new):
+    if _generation != installments_table.generation:
+        return
+    if old is not None:
+        _index_remove(old)
+    if new is not None:
+        _index_add(new)
+
+installments_table.subscribe(_on_installment_change)
+
+def _entries(start, end, limit):
+    # Returns [(due_date, installment, amount owed)] for the first `limit` due
+    # dates in [start, end), and how many dates the range holds in all.
+    lo = 0 if start is None else bisect_left(_due, (start,))
+    hi = bisect_left(_due, (end,))
+    by_key = installments_table.by_key()
+    results = []
+    for due_date, installment_id in _due[lo:hi if limit is None else min(hi, lo + limit)]:
+        inst = by_key[installment_id]
+        results.append((due_date, inst, next_due(inst)[1]))
+    return results, hi - lo
+
+@instrumented
+def overdue_installments(today=None, limit=None):
+    # Contracts whose next installment was due before today, oldest first.
+    _current()
+    return _entries(None, today or date.today(), limit)
+
+@instrumented
+def due_installments(days=7, today=None, limit=None):
+    # Contracts whose next installment falls due today or in the next `days`
+    # days, soonest first.
+    _current()
+    today = today or date.today()
+    return _entries(today, today + timedelta(days=days + 1), limit)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import pickle
+from operator import attrgetter
+from modules import config
+from modules import stats
+
+# Parsed copies of the CSV tables, so a process that starts, or reloads a
+# table another process rewrote, can skip csv parsing and Record.from_row.
+# <file>.snapshot holds a small header, then the typed rows as one list per
+# column: loading that and rebuilding the rows is a few times faster than
+# parsing the CSV again.
+#
+# The header records the CSV's size, mtime and a hash of its bytes. A
+# snapshot is used as it is only while all three still match. When the file
+# has since grown and its first `size` bytes still hash the same, rows were
+# only appended (payments, new contracts): the snapshot is used for those
+# bytes and just the rest is parsed. Any other change, by this program or by
+# hand, makes it stale, and the next full load parses the CSV and writes a
+# new one. Tables with a write-ahead log pending are always parsed, and files
+# under SNAPSHOT_MIN_BYTES are not worth it.
+
+FORMAT = 1
+
+def _snapshot_path(filepath):
+    return filepath + '.snapshot'
+
+def _digest(filepath, size):
+    # Hash of the first `size` bytes.
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        while size > 0:
+            chunk = f.read(min(size, 1 << 20))
+            if not chunk:
+                break
+            h.update(chunk)
+            size -= len(chunk)
+    return h.hexdigest()
+
+def _header(filepath, record, version):
+    return {
+        'format': FORMAT,
+        'fields': tuple(record.FIELDS),
+        'size': version[2],
+        'mtime_ns': version[1],
+        'digest': _digest(filepath, version[2]),
+    }
+
+def usable(version):
+    # `version` is file_version() of the CSV: (generation, mtime_ns, size)
+    # when there is no log, longer when there is.
+    return (config.SNAPSHOTS and not config.use_sqlite() and version is not None and len(version) == 3
+            and version[2] >= config.SNAPSHOT_MIN_BYTES)
+
+def _matches(header, filepath, record, version):
+    if header.get('format') != FORMAT or header.get('fields') != tuple(record.FIELDS):
+        return False
+    size = header.get('size', -1)
+    if size > version[2] or (size == version[2] and header.get('mtime_ns') != version[1]):
+        return False
+    return header.get('digest') == _digest(filepath, size)
+
+def load(filepath, record, version):
+    # (rows, size): the rows held in the CSV's first `size` bytes, which is
+    # all of it when size equals the version's. (None, 0) when there is no
+    # usable snapshot.
+    if not usable(version):
+        return None, 0
+    path = _snapshot_path(filepath)
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if not _matches(header, filepath, record, version):
+                return None, 0
+            rows = record.from_values(pickle.load(f))
+            stats.record_read(path, os.fstat(f.fileno()).st_size, len(rows))
+    except Exception:
+        # Missing, truncated or from an incompatible version: parse instead.
+        return None, 0
+    return rows, header['size']
+
+def stale(size, version):
+    # Whether a snapshot covering `size` bytes leaves enough of the file to
+    # parse on every load that it is worth writing again.
+    return version[2] - size > max(config.SNAPSHOT_MIN_BYTES, size // 4)
+
+def save(filepath, record, rows, version):
+    # Best effort: a snapshot that cannot be written only costs the next
+    # load a parse.
+    if not usable(version):
+        return False
+    path = _snapshot_path(filepath)
+    tmp = path + '.tmp'
+    try:
+        columns = [list(map(attrgetter(name), rows)) for name in record.FIELDS]
+        with open(tmp, 'wb') as f:
+            pickle.dump(_header(filepath, record, version), f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(columns, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.replace(tmp, path)
+    except (OSError, pickle.PicklingError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    stats.record_write(path, size)
+    return True
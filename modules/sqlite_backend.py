@@ -0,0 +1,178 @@
+import csv
+import os
+import sys
+import threading
+from modules import config
+
+# Each CSV path maps to a table named after the file (customers.csv ->
+# customers). Tables are created from the field names the first time they are
+# used: the first field is the INTEGER PRIMARY KEY, other *_id columns are
+# indexed INTEGER references, everything else is TEXT so values round-trip as
+# the same strings the CSV files hold. Triggers bump a per-table version on
+# every change, which is what file_version() reports instead of a file mtime.
+
+_local = threading.local()
+_known_tables = {}
+
+def _db_path():
+    return config.sqlite_path()
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != _db_path():
+        # Imported here so CSV-only runs never pay for loading sqlite3.
+        import sqlite3
+        os.makedirs(os.path.dirname(_db_path()), exist_ok=True)
+        conn = sqlite3.connect(_db_path(), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS _versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS _sequences (name TEXT PRIMARY KEY, next_id INTEGER NOT NULL)")
+        _local.conn = conn
+        _local.path = _db_path()
+    return conn
+
+def table_name(filepath):
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+def _columns(conn, name):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')]
+
+def ensure_table(filepath, fieldnames):
+    conn = _connect()
+    name = table_name(filepath)
+    if _known_tables.get((_db_path(), name)) == tuple(fieldnames):
+        return name
+
+    existing = _columns(conn, name)
+    if not existing:
+        key = fieldnames[0]
+        columns = [f'"{key}" INTEGER PRIMARY KEY']
+        for field in fieldnames[1:]:
+            columns.append(f'"{field}" INTEGER' if field.endswith('_id') else f'"{field}" TEXT')
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" ({", ".join(columns)})')
+    else:
+        for field in fieldnames:
+            if field not in existing:
+                conn.execute(f'ALTER TABLE "{name}" ADD COLUMN "{field}" TEXT')
+
+    for field in fieldnames[1:]:
+        if field.endswith('_id'):
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{name}_{field}" ON "{name}" ("{field}")')
+
+    conn.execute("INSERT OR IGNORE INTO _versions (name, version) VALUES (?, 0)", (name,))
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(
+            f'CREATE TRIGGER IF NOT EXISTS "{name}_{event.lower()}_version" AFTER {event} ON "{name}" '
+            f"BEGIN UPDATE _versions SET version = version + 1 WHERE name = '{name}'; END"
+        )
+    _known_tables[(_db_path(), name)] = tuple(fieldnames)
+    return name
+
+def _row_to_dict(columns, values):
+    return {column: '' if value is None else str(value) for column, value in zip(columns, values)}
+
+def iter_table(filepath):
+    conn = _connect()
+    name = table_name(filepath)
+    columns = _columns(conn, name)
+    if not columns:
+        return
+    cursor = conn.execute(f'SELECT * FROM "{name}" ORDER BY "{columns[0]}"')
+    for values in cursor:
+        yield _row_to_dict(columns, values)
+
+def read_table(filepath):
+    return list(iter_table(filepath))
+
+def table_version(filepath):
+    row = _connect().execute("SELECT version FROM _versions WHERE name = ?", (table_name(filepath),)).fetchone()
+    return ('sqlite', _db_path(), row[0] if row else None)
+
+def insert_rows(filepath, records, fieldnames):
+    conn = _connect()
+    name = ensure_table(filepath, fieldnames)
+    columns = ", ".join(f'"{field}"' for field in fieldnames)
+    placeholders = ", ".join("?" for _ in fieldnames)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            f'INSERT INTO "{name}" ({columns}) VALUES ({placeholders})',
+            [[record[field] for field in fieldnames] for record in records]
+        )
+
+def replace_table(filepath, data, fieldnames):
+    conn = _connect()
+    name = ensure_table(filepath, fieldnames)
+    columns = ", ".join(f'"{field}"' for field in fieldnames)
+    placeholders = ", ".join("?" for _ in fieldnames)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f'DELETE FROM "{name}"')
+        conn.executemany(
+            f'INSERT INTO "{name}" ({columns}) VALUES ({placeholders})',
+            [[record.get(field) for field in fieldnames] for record in data]
+        )
+
+def update_rows(filepath, fieldnames, key_column, records):
+    conn = _connect()
+    name = ensure_table(filepath, fieldnames)
+    fields = [field for field in fieldnames if field != key_column]
+    assignments = ", ".join(f'"{field}" = ?' for field in fields)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.executemany(
+            f'UPDATE "{name}" SET {assignments} WHERE "{key_column}" = ?',
+            [[record[field] for field in fields] + [record[key_column]] for record in records]
+        )
+    return cursor.rowcount == len(records)
+
+def delete_rows(filepath, fieldnames, key_column, keys):
+    conn = _connect()
+    name = ensure_table(filepath, fieldnames)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.executemany(f'DELETE FROM "{name}" WHERE "{key_column}" = ?', [(key,) for key in keys])
+    return cursor.rowcount == len(keys)
+
+def delete_row(filepath, fieldnames, key_column, key):
+    return delete_rows(filepath, fieldnames, key_column, [key])
+
+def next_id(filepath, id_column, count=1):
+    conn = _connect()
+    name = table_name(filepath)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT next_id FROM _sequences WHERE name = ?", (name,)).fetchone()
+        if row:
+            value = row[0]
+        elif _columns(conn, name):
+            value = conn.execute(f'SELECT COALESCE(MAX("{id_column}"), 0) + 1 FROM "{name}"').fetchone()[0]
+        else:
+            value = 1
+        conn.execute("INSERT OR REPLACE INTO _sequences (name, next_id) VALUES (?, ?)", (name, value + count))
+    return value
+
+def import_csv_files(filepaths):
+    # One-off migration: copies each CSV into its table, replacing what the
+    # table held, and seeds the ID sequences past the imported keys.
+    imported = {}
+    for filepath in filepaths:
+        with open(filepath, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            data = list(reader)
+            fieldnames = reader.fieldnames
+        if not fieldnames:
+            continue
+        replace_table(filepath, data, fieldnames)
+        conn = _connect()
+        name = table_name(filepath)
+        with conn:
+            conn.execute("DELETE FROM _sequences WHERE name = ?", (name,))
+        imported[filepath] = len(data)
+    return imported
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or [config.data_path(name) for name in ('customers.csv', 'products.csv', 'installments.csv')]
+    for path, count in import_csv_files(paths).items():
+        print(f"Imported {count} rows from {path} into {config.sqlite_path()}")
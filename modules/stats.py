@@ -0,0 +1,94 @@
+import functools
+import os
+import threading
+import time
+
+# Opt-in counters for the public functions of customer, product and
+# installment. Turn on with IMS_STATS=1 or stats.enable(). While off, an
+# instrumented call costs a single flag check.
+#
+# file_handler reports every read and write through record_read/record_write;
+# the I/O is charged to each instrumented call currently running on that
+# thread, so an outer call (create_installment) includes what its inner calls
+# (search_customer, search_product) did.
+
+_enabled = os.environ.get('IMS_STATS') == '1'
+_lock = threading.Lock()
+_local = threading.local()
+_operations = {}
+_files = {}
+
+COUNTERS = ('reads', 'writes', 'bytes_read', 'bytes_written', 'rows_parsed')
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _operations.clear()
+        _files.clear()
+
+def _empty_counters():
+    return dict.fromkeys(COUNTERS, 0)
+
+def _record(filepath, counters):
+    if not _enabled:
+        return
+    with _lock:
+        totals = _files.setdefault(filepath, _empty_counters())
+        for name, value in counters.items():
+            totals[name] += value
+    for frame in getattr(_local, 'stack', []):
+        for name, value in counters.items():
+            frame[name] += value
+
+def record_read(filepath, nbytes=0, rows=0):
+    _record(filepath, {'reads': 1, 'bytes_read': nbytes, 'rows_parsed': rows})
+
+def record_write(filepath, nbytes=0):
+    _record(filepath, {'writes': 1, 'bytes_written': nbytes})
+
+def instrumented(func):
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        frame = _empty_counters()
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            stack.pop()
+            with _lock:
+                totals = _operations.setdefault(name, dict(_empty_counters(), calls=0, total_ms=0.0, max_ms=0.0))
+                totals['calls'] += 1
+                totals['total_ms'] += elapsed_ms
+                totals['max_ms'] = max(totals['max_ms'], elapsed_ms)
+                for counter, value in frame.items():
+                    totals[counter] += value
+
+    return wrapper
+
+def operation_stats():
+    with _lock:
+        return {name: dict(totals) for name, totals in _operations.items()}
+
+def file_stats():
+    with _lock:
+        return {filepath: dict(totals) for filepath, totals in _files.items()}
@@ -0,0 +1,443 @@
+import gc
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from itertools import chain, islice
+from modules import config
+from modules import snapshot
+from modules.file_handler import (read_csv, read_tail, iter_csv, append_records, update_records,
+                                  delete_records, ensure_file_exists, file_version, recover_csv, upgrade_header,
+                                  locked, changes_since, undecodable, raw_row, write_csv)
+
+@contextmanager
+def _gc_paused():
+    # A full load allocates a few objects per row and none of them form
+    # cycles; left running, the collector would walk the growing heap over
+    # and over while they are created.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _unindex(index, value, row):
+    bucket = index.get(value, [])
+    bucket[:] = [r for r in bucket if r is not row]
+    if not bucket:
+        index.pop(value, None)
+
+class Table:
+    # One table (a CSV file, or its SQLite counterpart) kept in memory as a
+    # list of typed rows (see modules/records.py) plus a dict from primary key
+    # to row. Rows are parsed once when read and formatted back to the CSV
+    # strings only when written. The table is read again only
+    # when file_version() changes (mtime and size for CSV, a change counter for
+    # SQLite), so edits made by another process are still picked up. Columns
+    # listed in `indexes` also get a value -> [rows] map for non-unique lookups.
+    #
+    # Every write holds the file's lock and first re-checks the version, so it
+    # is applied to the latest rows rather than to a stale copy. Callers that
+    # compute new values from current ones (payments) wrap the read and the
+    # write in transaction() so nothing can change in between.
+    #
+    # When another process has only appended rows or log entries, refresh()
+    # applies just those instead of reloading. Callbacks registered with
+    # subscribe() see every row-level change as (old_row, new_row), with None
+    # for the missing side of an insert or delete; a full reload is signalled
+    # by a new `generation` instead.
+    #
+    # Tables whose rows are partly derived from another table set `derive`
+    # (called on every row read from disk) and register on_refresh() callbacks
+    # that fold in the other table's changes through peek() and patch().
+    #
+    # Full loads come from the file's parsed snapshot when it is still fresh
+    # (see modules/snapshot.py), and write a new one when it is not.
+    #
+    # Nothing is read, or created, until the first access. The file is
+    # `filename` in config.DATA_DIR as it is at that point; pointing DATA_DIR
+    # elsewhere makes the next access load the other directory's file.
+
+    def __init__(self, filename, fieldnames, key, record, indexes=(), compact=False):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.key = key
+        self.record = record
+        # Whether appends periodically rewrite the file (see COMPACT_EVERY).
+        self.compact = compact
+        self._rows = []
+        # Rows that could not be parsed, as read, so rewrites keep them.
+        self._rejects = []
+        self._by_key = {}
+        self._indexes = {column: {} for column in indexes}
+        self._version = None
+        # Path the rows were loaded from.
+        self._path = None
+        # Bumped on every full reload so derived caches know to rebuild.
+        self.generation = 0
+        self._listeners = []
+        self._refresh_callbacks = []
+        self.derive = None
+
+    @property
+    def filepath(self):
+        return config.data_path(self.filename)
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self, old, new):
+        for callback in self._listeners:
+            callback(old, new)
+
+    def on_refresh(self, callback):
+        self._refresh_callbacks.append(callback)
+
+    def _file_version(self):
+        return file_version(self.filepath)
+
+    def _load(self):
+        with _gc_paused():
+            self._load_rows()
+
+    def _load_rows(self):
+        filepath = self.filepath
+        with locked(filepath):
+            ensure_file_exists(filepath, self.fieldnames)
+            if self._path != filepath:
+                recover_csv(filepath, self.fieldnames)
+                upgrade_header(filepath, self.fieldnames)
+            self._version = self._file_version()
+            # A snapshot only holds parsed rows, so none is saved while the
+            # file has rows that do not parse.
+            rejects = []
+            rows, size = snapshot.load(filepath, self.record, self._version)
+            if rows is not None and size < self._version[2]:
+                # Only appended to since the snapshot was written.
+                tail = read_tail(filepath, self.fieldnames, size, self._version[2])
+                if tail is None:
+                    rows = None
+                else:
+                    rows.extend(self._parse(tail, rejects))
+                    if snapshot.stale(size, self._version) and not rejects:
+                        snapshot.save(filepath, self.record, rows, self._version)
+            if rows is None:
+                rejects = []
+                rows = list(self._parse(read_csv(filepath), rejects))
+                if not rejects:
+                    snapshot.save(filepath, self.record, rows, self._version)
+            if self.derive:
+                for row in rows:
+                    self.derive(row)
+            self._rows = rows
+            self._rejects = rejects
+            self._path = filepath
+        self.generation += 1
+        self._by_key = {getattr(row, self.key): row for row in self._rows}
+        for column, index in self._indexes.items():
+            index.clear()
+            for row in self._rows:
+                index.setdefault(getattr(row, column), []).append(row)
+
+    def _parse(self, rows, rejects=None):
+        # Rows that cannot be parsed (a torn or hand-edited line) are left out
+        # of the typed rows; with `rejects`, they are added to it as read.
+        for row in rows:
+            try:
+                if None in row:
+                    raise ValueError("Too many values")
+                if undecodable(row):
+                    raise ValueError("Not UTF-8")
+                yield self.record.from_row(row)
+            except (KeyError, TypeError, ValueError):
+                if rejects is not None:
+                    rejects.append(raw_row(row, self.fieldnames))
+
+    def _parse_rows(self, rows):
+        for record in self._parse(rows):
+            if self.derive:
+                self.derive(record)
+            yield record
+
+    def _coerce(self, column, value):
+        # Turns a caller's key ("12" or 12) into the typed value rows hold;
+        # None when it cannot match any row.
+        try:
+            return self.record.parse(column, value)
+        except (TypeError, ValueError):
+            return None
+
+    def _index_add(self, row):
+        for column, index in self._indexes.items():
+            index.setdefault(getattr(row, column), []).append(row)
+
+    def _index_remove(self, row):
+        for column, index in self._indexes.items():
+            _unindex(index, getattr(row, column), row)
+
+    def _reindex(self, row, old):
+        # Moves `row` to its new bucket in the indexes whose column changed
+        # from `old`. Unchanged columns leave the row where it is in its
+        # bucket, so lookups keep returning rows in the order they were added.
+        for column, index in self._indexes.items():
+            before = getattr(old, column)
+            after = getattr(row, column)
+            if before != after:
+                _unindex(index, before, row)
+                index.setdefault(after, []).append(row)
+
+    def _formatted(self, rows=None):
+        # What a full rewrite writes: the typed rows, then the rows that did
+        # not parse, unchanged, so a rewrite never drops what it could not read.
+        rows = self._rows if rows is None else rows
+        return chain((row.to_row() for row in rows), self._rejects)
+
+    def refresh(self):
+        if self._path != self.filepath:
+            self._load()
+        elif self._file_version() != self._version:
+            with locked(self.filepath):
+                version = self._file_version()
+                if version != self._version:
+                    if not self._catch_up(version):
+                        self._load()
+        for callback in self._refresh_callbacks:
+            callback()
+
+    def _catch_up(self, version):
+        changes = changes_since(self.filepath, self.fieldnames, self._version, version)
+        if changes is None:
+            return False
+        new_rows, key_column, overlay = changes
+        for new in new_rows:
+            if None in new or None in new.values() or undecodable(new):
+                return False
+            try:
+                row = self.record.from_row(new)
+            except (TypeError, ValueError):
+                return False
+            if self.derive:
+                self.derive(row)
+            self._rows.append(row)
+            self._by_key[getattr(row, self.key)] = row
+            self._index_add(row)
+            self._notify(None, row)
+        for key, new in overlay.items():
+            key = self._coerce(self.key, key)
+            if key_column != self.key or key not in self._by_key:
+                continue
+            row = self._by_key[key]
+            if new is None:
+                self._rows = [r for r in self._rows if r is not row]
+                del self._by_key[key]
+                self._index_remove(row)
+                self._notify(row, None)
+            else:
+                try:
+                    parsed = self.record.from_row(new)
+                except (KeyError, TypeError, ValueError):
+                    return False
+                if self.derive:
+                    self.derive(parsed)
+                old = row.copy()
+                row.assign(parsed)
+                self._reindex(row, old)
+                self._notify(old, row)
+        self._version = version
+        return True
+
+    def _mark_saved(self):
+        self._version = self._file_version()
+
+    @contextmanager
+    def transaction(self):
+        with locked(self.filepath):
+            self.refresh()
+            yield self
+
+    def rows(self):
+        self.refresh()
+        return self._rows
+
+    def get(self, key):
+        self.refresh()
+        return self._by_key.get(self._coerce(self.key, key))
+
+    def by_key(self):
+        self.refresh()
+        return self._by_key
+
+    def lookup(self, column, value):
+        self.refresh()
+        return self._indexes[column].get(self._coerce(column, value), [])
+
+    def index(self, column):
+        # The whole value -> [rows] map of an indexed column, checked for
+        # freshness once, for passes that look up many values (see join()).
+        self.refresh()
+        return self._indexes[column]
+
+    def __len__(self):
+        self.refresh()
+        return len(self._rows)
+
+    def peek(self, key):
+        # get() without the freshness check, for on_refresh() callbacks and
+        # derive functions.
+        return self._by_key.get(self._coerce(self.key, key))
+
+    def peek_lookup(self, column, value):
+        return self._indexes[column].get(self._coerce(column, value), [])
+
+    def patch(self, row, changes):
+        # Changes a row in memory only, for values derived from another table.
+        # Listeners are notified as for update().
+        old = row.copy()
+        for name, value in changes.items():
+            setattr(row, name, value)
+        self._reindex(row, old)
+        self._notify(old, row)
+
+    def stream(self):
+        # Typed rows read straight from disk, for one-pass reports that should
+        # not hold the whole table in memory.
+        for callback in self._refresh_callbacks:
+            callback()
+        return self._parse_rows(iter_csv(self.filepath))
+
+    def insert(self, record):
+        return self.insert_many([record])
+
+    def insert_many(self, records):
+        with locked(self.filepath):
+            self.refresh()
+            if not append_records(self.filepath, [record.to_row() for record in records], self.fieldnames,
+                                  compact=self.compact):
+                return False
+            self._added(records)
+            return True
+
+    def reinsert(self, records):
+        # insert_many() for rows just deleted, to undo that delete. A CSV is
+        # rewritten rather than appended to: with the log on, the delete may
+        # still be logged, and it would hide the appended rows.
+        if config.use_sqlite():
+            return self.insert_many(records)
+        with locked(self.filepath):
+            self.refresh()
+            if not write_csv(self.filepath, self._formatted(self._rows + list(records)), self.fieldnames):
+                return False
+            self._added(records)
+            return True
+
+    def _added(self, records):
+        for row in records:
+            self._rows.append(row)
+            self._by_key[getattr(row, self.key)] = row
+            self._index_add(row)
+            self._notify(None, row)
+        self._mark_saved()
+
+    def update(self, key, changes):
+        return self.update_many({key: changes})
+
+    def update_many(self, changes_by_key):
+        # Applies every change and persists them with a single write.
+        with locked(self.filepath):
+            self.refresh()
+            rows = [self._by_key.get(self._coerce(self.key, key)) for key in changes_by_key]
+            if not rows or None in rows:
+                return False
+            olds = [row.copy() for row in rows]
+            for row, old, changes in zip(rows, olds, changes_by_key.values()):
+                for name, value in changes.items():
+                    setattr(row, name, value)
+                self._reindex(row, old)
+            if not update_records(self.filepath, self._formatted(), self.fieldnames, self.key,
+                                  [row.to_row() for row in rows]):
+                for row, old in zip(rows, olds):
+                    new = row.copy()
+                    row.assign(old)
+                    self._reindex(row, new)
+                return False
+            for row, old in zip(rows, olds):
+                self._notify(old, row)
+            self._mark_saved()
+            return True
+
+    def delete(self, key):
+        return self.delete_many([key])
+
+    def delete_many(self, keys):
+        # Removes every row in `keys` with a single write.
+        with locked(self.filepath):
+            self.refresh()
+            doomed = [self._by_key.get(self._coerce(self.key, key)) for key in keys]
+            if not doomed or None in doomed:
+                return False
+            doomed_ids = {id(row) for row in doomed}
+            rows = [r for r in self._rows if id(r) not in doomed_ids]
+            if not delete_records(self.filepath, self._formatted(rows), self.fieldnames, self.key,
+                                  [getattr(row, self.key) for row in doomed]):
+                return False
+            self._rows = rows
+            for row in doomed:
+                del self._by_key[getattr(row, self.key)]
+                self._index_remove(row)
+                self._notify(row, None)
+            self._mark_saved()
+            return True
+
+def join(rows, table, column):
+    # Pairs each row with the row of `table` whose key equals row[column]
+    # (None when missing). The other table is checked for freshness once, not
+    # once per row, so a report costs one pass over each file.
+    by_key = table.by_key()
+    for row in rows:
+        yield row, by_key.get(getattr(row, column))
+
+def paginate(rows, offset=0, limit=None):
+    # Returns an iterator over one page of `rows` and whether more rows follow.
+    # Only offset + limit + 1 rows are ever pulled from `rows`.
+    rows = islice(rows, offset, None)
+    if limit is None:
+        return rows, False
+    page = list(islice(rows, limit + 1))
+    return iter(page[:limit]), len(page) > limit
+
+class SortedIndex:
+    # (key, primary key) pairs kept in sorted order, for prefix lookups that
+    # a dict cannot answer. Adding or removing one pair is a bisect plus a
+    # list insert or delete.
+
+    def __init__(self):
+        self._entries = []
+
+    def build(self, pairs):
+        self._entries = sorted(pairs)
+
+    def add(self, key, pk):
+        insort(self._entries, (key, pk))
+
+    def remove(self, key, pk):
+        n = bisect_left(self._entries, (key, pk))
+        if n < len(self._entries) and self._entries[n] == (key, pk):
+            del self._entries[n]
+
+    def _range(self, prefix):
+        if not prefix:
+            return 0, len(self._entries)
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return bisect_left(self._entries, (prefix,)), bisect_left(self._entries, (end,))
+
+    def prefix(self, prefix):
+        # Primary keys of every key starting with `prefix`, in key order.
+        lo, hi = self._range(prefix)
+        return [pk for _, pk in self._entries[lo:hi]]
+
+    def count(self, prefix):
+        lo, hi = self._range(prefix)
+        return hi - lo
+
+    def __len__(self):
+        return len(self._entries)
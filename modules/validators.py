@@ -1,25 +1,48 @@
-def validate_phone(phone):
-    if not phone:
-        return False
-    return len(phone) >= 10 and phone.isdigit()
-
-def validate_name(name):
-    return name and len(name) >= 2
-
-def validate_price(price):
-    try:
-        return float(price) > 0
-    except:
-        return False
-
-def validate_id(id_val):
-    try:
-        return int(id_val) > 0
-    except:
-        return False
-
-def validate_amount(amount):
-    try:
-        return float(amount) > 0
-    except:
-        return False
+from decimal import Decimal
+from modules.records import parse_amount, parse_date
+
+def _amount(text):
+    # parse_amount for input with at most two decimal places; it would round
+    # "1.005" to 101 paisa rather than reject it.
+    units = parse_amount(text)
+    if Decimal(str(text).strip()).as_tuple().exponent < -2:
+        raise ValueError(f"Invalid amount: {text!r}")
+    return units
+
+def validate_phone(phone):
+    if not phone:
+        return False
+    return len(phone) >= 10 and phone.isdigit()
+
+def validate_name(name):
+    return name and len(name) >= 2
+
+def validate_price(price):
+    try:
+        return _amount(price) > 0
+    except:
+        return False
+
+def validate_id(id_val):
+    try:
+        return int(id_val) > 0
+    except:
+        return False
+
+def validate_amount(amount):
+    try:
+        return _amount(amount) > 0
+    except:
+        return False
+
+def validate_months(months):
+    try:
+        return 1 <= int(months) <= 120
+    except:
+        return False
+
+def validate_date(text):
+    try:
+        return parse_date(text) is not None
+    except:
+        return False
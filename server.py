@@ -0,0 +1,294 @@
+# Serves the customer, product and installment functions as a JSON API from
+# one long-running process, so every counter works against the same warm
+# tables instead of each terminal re-reading the files.
+#
+#   python server.py                      # http://127.0.0.1:8000
+#   python server.py --host 0.0.0.0 --port 9000 --data-dir /srv/ims/data
+#
+# Requests are handled on threads, but every call into modules/ runs under one
+# lock: the tables and the running totals built on them are not thread-safe.
+# Bodies and responses are JSON; rows come back with the same string values
+# the CSV files hold. Errors are {"error": message} with a 400 or 404 status,
+# or 500 if a call fails unexpectedly.
+#
+#   GET    /customers?name=&phone=&address=&limit=   find customers
+#   POST   /customers                                {name, phone, address}
+#   GET    /customers/<id>
+#   PATCH  /customers/<id>                           {name, phone, address}
+#   DELETE /customers/<id>?cascade=1
+#   GET    /customers/<id>/installments
+#   GET    /customers/<id>/balance
+#   POST   /products                                 {product_name, price}
+#   GET    /products/<id>
+#   PATCH  /products/<id>                            {product_name, price}
+#   DELETE /products/<id>?cascade=1
+#   POST   /installments                             {customer_id, product_id, paid_amount, months, start_date}
+#   GET    /installments/<id>                        includes the payment schedule
+#   GET    /installments/<id>/payments
+#   POST   /installments/<id>/payments               {amount}
+#   GET    /reports/portfolio
+#   GET    /reports/overdue?limit=
+#   GET    /reports/due?days=7&limit=
+
+import argparse
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import modules.analytics as analytics
+import modules.customer as customer
+import modules.installment as installment
+import modules.product as product
+import modules.schedule as schedule
+from modules import config
+from modules.records import format_amount, format_date
+
+_lock = threading.RLock()
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def _fail(message):
+    missing = message.endswith("not found") or message.startswith("No ")
+    raise ApiError(message, 404 if missing else 400)
+
+def _result(success, message, status=200):
+    if not success:
+        _fail(message)
+    return status, {'message': message}
+
+def _found(row, message):
+    if row is None:
+        _fail(message)
+    return 200, row.to_row()
+
+def _int(query, name, default=None):
+    try:
+        return int(query[name]) if name in query else default
+    except ValueError:
+        raise ApiError(f"Invalid {name}")
+
+def _due_entries(entries, count):
+    return 200, {
+        'count': count,
+        'installments': [dict(inst.to_row(), due_date=format_date(due_date), owed=format_amount(owed))
+                         for due_date, inst, owed in entries],
+    }
+
+def find_customers(query, body):
+    matches, message = customer.find_customers(query.get('name'), query.get('phone'), query.get('address'),
+                                               limit=_int(query, 'limit', 50))
+    if not any(query.get(field, '').strip() for field in ('name', 'phone', 'address')):
+        _fail(message)
+    return 200, [row.to_row() for row in matches]
+
+def _text(body, name, default=None):
+    # JSON numbers and the like are passed on as the strings a form would send.
+    value = body.get(name, default)
+    return None if value is None else str(value)
+
+def add_customer(query, body):
+    return _result(*customer.add_customer(_text(body, 'name', ''), _text(body, 'phone', ''),
+                                          _text(body, 'address', '')),
+                   status=201)
+
+def get_customer(query, body, customer_id):
+    return _found(*customer.search_customer(customer_id))
+
+def update_customer(query, body, customer_id):
+    return _result(*customer.update_customer(customer_id, _text(body, 'name'), _text(body, 'phone'),
+                                             _text(body, 'address')))
+
+def delete_customer(query, body, customer_id):
+    return _result(*customer.delete_customer(customer_id, cascade=query.get('cascade') == '1'))
+
+def customer_installments(query, body, customer_id):
+    rows, message = installment.get_customer_installments(customer_id)
+    if message:
+        _fail(message)
+    return 200, [row.to_row() for row in rows]
+
+def customer_balance(query, body, customer_id):
+    totals, message = installment.get_customer_totals(customer_id)
+    if totals is None:
+        _fail(message)
+    return 200, {name: format_amount(value) if name in ('outstanding', 'paid') else value
+                 for name, value in totals.items()}
+
+def add_product(query, body):
+    return _result(*product.add_product(_text(body, 'product_name', ''), _text(body, 'price', '')), status=201)
+
+def get_product(query, body, product_id):
+    return _found(*product.search_product(product_id))
+
+def update_product(query, body, product_id):
+    return _result(*product.update_product(product_id, _text(body, 'product_name'), _text(body, 'price')))
+
+def delete_product(query, body, product_id):
+    return _result(*product.delete_product(product_id, cascade=query.get('cascade') == '1'))
+
+def create_installment(query, body):
+    return _result(*installment.create_installment(_text(body, 'customer_id'), _text(body, 'product_id'),
+                                                   _text(body, 'paid_amount', ''), _text(body, 'months'),
+                                                   _text(body, 'start_date')),
+                   status=201)
+
+def get_installment(query, body, installment_id):
+    inst, message = installment.search_installment(installment_id)
+    if inst is None:
+        _fail(message)
+    return 200, dict(inst.to_row(), schedule=[
+        {'number': number, 'due_date': format_date(due_date), 'amount': format_amount(amount),
+         'owed': format_amount(owed)}
+        for number, due_date, amount, owed in schedule.payment_schedule(inst)
+    ])
+
+def payment_history(query, body, installment_id):
+    payments, message = installment.get_payment_history(installment_id)
+    if message:
+        _fail(message)
+    return 200, [payment.to_row() for payment in payments]
+
+def make_payment(query, body, installment_id):
+    return _result(*installment.make_payment(installment_id, _text(body, 'amount', '')), status=201)
+
+def portfolio_report(query, body):
+    summary = analytics.portfolio_summary()
+    return 200, {
+        'summary': {name: format_amount(value) if name in ('total', 'paid', 'outstanding') else value
+                    for name, value in summary.items()},
+        'collection_buckets': {label: {'contracts': bucket['contracts'],
+                                       'outstanding': format_amount(bucket['outstanding'])}
+                               for label, bucket in analytics.collection_buckets().items()},
+    }
+
+def overdue_report(query, body):
+    return _due_entries(*schedule.overdue_installments(limit=_int(query, 'limit', 100)))
+
+def due_report(query, body):
+    return _due_entries(*schedule.due_installments(_int(query, 'days', 7), limit=_int(query, 'limit', 100)))
+
+ROUTES = [
+    ('GET', r'/customers', find_customers),
+    ('POST', r'/customers', add_customer),
+    ('GET', r'/customers/(\d+)', get_customer),
+    ('PATCH', r'/customers/(\d+)', update_customer),
+    ('DELETE', r'/customers/(\d+)', delete_customer),
+    ('GET', r'/customers/(\d+)/installments', customer_installments),
+    ('GET', r'/customers/(\d+)/balance', customer_balance),
+    ('POST', r'/products', add_product),
+    ('GET', r'/products/(\d+)', get_product),
+    ('PATCH', r'/products/(\d+)', update_product),
+    ('DELETE', r'/products/(\d+)', delete_product),
+    ('POST', r'/installments', create_installment),
+    ('GET', r'/installments/(\d+)', get_installment),
+    ('GET', r'/installments/(\d+)/payments', payment_history),
+    ('POST', r'/installments/(\d+)/payments', make_payment),
+    ('GET', r'/reports/portfolio', portfolio_report),
+    ('GET', r'/reports/overdue', overdue_report),
+    ('GET', r'/reports/due', due_report),
+]
+ROUTES = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in ROUTES]
+
+def dispatch(method, path, query, body):
+    # Returns (status, JSON-ready response) for one request.
+    allowed = False
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.match(path)
+        if not match:
+            continue
+        allowed = True
+        if route_method != method:
+            continue
+        try:
+            with _lock:
+                return handler(query, body, *match.groups())
+        except ApiError as e:
+            return e.status, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': f"Internal error: {e}"}
+    if allowed:
+        return 405, {'error': "Method not allowed"}
+    return 404, {'error': "Not found"}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this each
+    # keep-alive response waits on the client's delayed ACK.
+    disable_nagle_algorithm = True
+    quiet = False
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        body = {}
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # The body cannot be skipped, so the connection cannot be reused.
+            self.close_connection = True
+            return self._send(400, {'error': "Invalid Content-Length"})
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                return self._send(400, {'error': "Body must be a JSON object"})
+        self._send(*dispatch(self.command, url.path.rstrip('/') or '/', query, body))
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+def warm_up():
+    # Loads every table and derived index before the first request arrives.
+    with _lock:
+        customer.customers_table.rows()
+        product.products_table.rows()
+        installment.get_portfolio_totals()
+        analytics.portfolio_summary()
+        schedule.overdue_installments(limit=0)
+
+def make_server(host='127.0.0.1', port=8000, quiet=False):
+    Handler.quiet = quiet
+    return ThreadingHTTPServer((host, port), Handler)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the installment management system as a JSON API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--quiet', action='store_true', help="do not log each request")
+    parser.add_argument('--data-dir', help="directory holding the data files (default: data/ or IMS_DATA_DIR)")
+    args = parser.parse_args(argv)
+
+    if args.data_dir:
+        config.set_data_dir(args.data_dir)
+    warm_up()
+    server = make_server(args.host, args.port, args.quiet)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()